@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# This file is part of Workflow.
+# Copyright (C) 2018 CERN.
+#
+# Workflow is free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Measure how long it takes to build and to evaluate pattern based workflows.
+
+Usage: benchmark_patterns.py [number of repetitions]
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+from workflow.patterns import controlflow as cf
+from workflow.patterns import utils as ut
+
+
+def task(obj, eng):
+    pass
+
+
+def build(size=200):
+    """Return a workflow definition nesting patterns around big arguments."""
+    items = list(range(1000))
+    return [
+        cf.IF_ELSE(
+            cf.CMP(ut.OBJ_GET('key'), i, '=='),
+            [task, cf.FOR(items, 'item', [task, ut.ENG_SET('items', items)])],
+            [cf.WHILE(cf.CMP(ut.ENG_GET('count'), 10, '<'),
+                      [task, cf.IF(cf.CMP(ut.OBJ_GET('key'), items, 'in'),
+                                   [task, ut.OBJ_SET('items', items)])])]
+        )
+        for i in range(size)
+    ]
+
+
+def compare(cmp):
+    obj = {'key': 5}
+    for _ in range(1000):
+        cmp(obj, None)
+
+
+def main(repeat=5):
+    cmp = cf.CMP(ut.OBJ_GET('key'), 10, '<')
+    for name, stmt in (('build', build), ('CMP x 1000', lambda: compare(cmp))):
+        best = min(timeit.repeat(stmt, number=1, repeat=repeat))
+        print('%-12s %8.2f ms' % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
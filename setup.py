@@ -52,6 +52,9 @@ setup_requires = [
 if platform.python_version_tuple() < ('3', '4'):
     install_requires.append('enum34>=1.0.4')
 
+if platform.python_version_tuple() < ('3', '2'):
+    install_requires.append('futures>=3.1.1')
+
 packages = find_packages(exclude=['docs', 'tests'])
 
 URL = 'https://github.com/inveniosoftware/workflow'
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Workflow.
+# Copyright (C) 2018 CERN.
+#
+# Workflow is free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+import threading
+
+import mock
+import pytest
+
+from workflow.claims import ClaimWorker, SQLiteClaimQueue
+from workflow.engine_db import DbWorkflowEngine, ObjectStatus
+from workflow.utils import classproperty
+
+
+class Token(object):
+    def __init__(self, id_object):
+        self.id = id_object
+        self.status = ObjectStatus.INITIAL
+        self.callback_pos = None
+
+    def save(self, status=None, callback_pos=None, id_workflow=None,
+             task_counter=None):
+        if status is not None:
+            self.status = status
+        if task_counter is not None:
+            self.callback_pos = task_counter
+
+    def set_error_message(self, message):
+        pass
+
+    @classproperty
+    def known_statuses(cls):
+        return ObjectStatus
+
+
+@pytest.fixture
+def queue(tmpdir):
+    return SQLiteClaimQueue(str(tmpdir.join('claims.db')), 'test', lease=60)
+
+
+class TestSQLiteClaimQueue(object):
+
+    def test_claims_are_exclusive(self, queue):
+        queue.add(range(5))
+        first = queue.claim('worker-1', 3)
+        second = queue.claim('worker-2', 3)
+        assert [i for i, _ in first] == ['0', '1', '2']
+        assert [i for i, _ in second] == ['3', '4']
+        assert queue.claim('worker-3', 3) == []
+        assert queue.counts() == {'leased': 5}
+
+    def test_expired_leases_are_reclaimed(self, queue):
+        queue.add(range(2))
+        with mock.patch('workflow.claims.time.time', return_value=0):
+            queue.claim('worker-1', 2)
+        with mock.patch('workflow.claims.time.time', return_value=30):
+            assert queue.claim('worker-2', 2) == []
+            assert queue.heartbeat('worker-1', ['0']) == ['0']
+        with mock.patch('workflow.claims.time.time', return_value=61):
+            reclaimed = queue.claim('worker-2', 2)
+        assert [i for i, _ in reclaimed] == ['1']
+
+        # worker-1 lost the object and cannot complete it anymore.
+        assert queue.complete('worker-1', {'1': ObjectStatus.COMPLETED}) == []
+        assert queue.complete('worker-2', {'1': ObjectStatus.COMPLETED}) == [
+            '1'
+        ]
+
+    def test_release_and_resume(self, queue):
+        queue.add(['a'])
+        queue.claim('worker-1', 1)
+        assert queue.release('worker-1', ['a']) == ['a']
+        queue.claim('worker-1', 1)
+        queue.complete('worker-1', {'a': ObjectStatus.HALTED})
+        assert queue.claim('worker-1', 1) == []
+
+        queue.add(['a'], status=ObjectStatus.HALTED)
+        assert queue.claim('worker-1', 1) == [('a', ObjectStatus.HALTED)]
+
+    def test_leased_objects_are_not_made_ready(self, queue):
+        queue.add(['a', 'b'])
+        queue.claim('worker-1', 1)
+        assert queue.add(['a', 'b'], status=ObjectStatus.HALTED) == ['a']
+        assert queue.claim('worker-2', 2) == [('b', ObjectStatus.HALTED)]
+        assert queue.complete('worker-1', {'a': ObjectStatus.COMPLETED}) == [
+            'a'
+        ]
+
+
+class TestClaimWorker(object):
+
+    def setup_method(self, method):
+        self.tokens = dict((str(i), Token(i)) for i in range(20))
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def loader(self, ids):
+        return [self.tokens[i] for i in ids]
+
+    def engine_factory(self, callbacks=None):
+        def record(obj, eng):
+            with self.lock:
+                self.processed.append(obj.id)
+
+        def factory():
+            wfe = DbWorkflowEngine(mock.Mock())
+            wfe.callbacks.add_many(callbacks or [record])
+            return wfe
+        return factory
+
+    def test_workers_do_not_double_process(self, queue):
+        queue.add(self.tokens)
+        workers = [
+            ClaimWorker(queue, self.engine_factory(), self.loader,
+                        name='worker-%d' % i, batch_size=3)
+            for i in range(4)
+        ]
+        threads = [threading.Thread(target=worker.run) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(self.processed) == list(range(20))
+        assert queue.counts() == {'done': 20}
+
+    def test_halted_objects_are_resumed(self, queue):
+        def approve(obj, eng):
+            if not getattr(obj, 'approved', False):
+                obj.approved = True
+                eng.halt('approval')
+
+        def record(obj, eng):
+            self.processed.append(obj.id)
+
+        queue.add(['1', '2'])
+        worker = ClaimWorker(queue, self.engine_factory([approve, record]),
+                             self.loader)
+        worker.run()
+        assert self.processed == []
+        assert self.tokens['1'].status == ObjectStatus.HALTED
+
+        queue.add(['1', '2'], status=ObjectStatus.HALTED)
+        worker.run()
+        assert self.processed == [1, 2]
+        assert self.tokens['1'].status == ObjectStatus.COMPLETED
+
+    def test_failed_loader_releases_objects(self, queue):
+        def loader(ids):
+            raise IOError()
+
+        queue.add(['1'])
+        worker = ClaimWorker(queue, self.engine_factory(), loader)
+        with pytest.raises(IOError):
+            worker.run_once()
+        assert queue.counts() == {'ready': 1}
+
+    def test_lost_leases_are_reported(self, queue):
+        def steal(obj, eng):
+            # Another worker reclaims the object while it is processed.
+            with mock.patch('workflow.claims.time.time', return_value=1e12):
+                queue.claim('worker-2', 1)
+
+        queue.add(['1'])
+        worker = ClaimWorker(queue, self.engine_factory([steal]), self.loader)
+        with mock.patch('workflow.claims.log') as log:
+            worker.run_once()
+        assert worker.lost == ['1']
+        assert log.error.called
+        assert queue.counts() == {'leased': 1}
+
+    def test_heartbeat_stops_renewing_lost_leases(self, queue):
+        queue.add(['1', '2'])
+        queue.claim('worker-1', 2)
+        queue.release('worker-1', ['2'])
+        worker = ClaimWorker(queue, self.engine_factory(), self.loader,
+                             name='worker-1', heartbeat=0.01)
+        ids = ['1', '2']
+        stop = threading.Event()
+        with mock.patch('workflow.claims.log') as log:
+            thread = threading.Thread(target=worker._heartbeat,
+                                      args=(ids, stop))
+            thread.start()
+            while ids == ['1', '2']:
+                stop.wait(0.01)
+            stop.set()
+            thread.join()
+        assert ids == ['1']
+        assert log.warning.called
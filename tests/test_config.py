@@ -10,8 +10,13 @@
 import unittest
 import os
 import logging
+import threading
+import time
+import mock
+import pytest
 from six import StringIO
 
+from workflow import config
 from workflow.config import config_reader
 
 
@@ -41,6 +46,140 @@ class TestConfig(object):
         assert config_reader.OVERRIDEN == 'global'
         assert config_reader.string == 'second'
 
+    def test_accessor(self):
+        local = config_reader.accessor('local')
+        local2 = config_reader.accessor('local2')
+        with mock.patch('workflow.config.CustomConfigObj',
+                        wraps=config.CustomConfigObj) as parser:
+            for _ in range(3):
+                assert local.OVERRIDEN == 'local'
+                assert local2.OVERRIDEN == 'global'
+                assert local2.string == 'second'
+            # Every local configuration is parsed once.
+            assert parser.call_count == 2
+
+        assert config_reader.accessor().STRING == 'string'
+        with pytest.raises(AttributeError):
+            local.MISSING
+        with pytest.raises(AttributeError):
+            local.STRING = 'changed'
+
+    def test_reload(self, tmpdir):
+        tmpdir.join('global.ini').write('POOL = 4\nURL = http://a\n')
+        tmpdir.join('worker.ini').write('URL = http://b\n')
+        reader = config.ConfigReader(basedir=str(tmpdir))
+        current = reader.accessor('worker')
+        pinned = reader.accessor('worker', pin=True)
+        assert current.URL == 'http://b'
+
+        tmpdir.join('global.ini').write('POOL = 8\n')
+        tmpdir.join('worker.ini').write('URL = http://c\n')
+        reader.reload()
+        assert (current.POOL, current.URL) == ('8', 'http://c')
+        # A pinned accessor keeps a consistent configuration.
+        assert (pinned.POOL, pinned.URL) == ('4', 'http://b')
+
+    def test_watch(self, tmpdir):
+        tmpdir.join('global.ini').write('POOL = 4\n')
+        reader = config.ConfigReader(basedir=str(tmpdir))
+        current = reader.accessor('worker')
+        reader.watch(interval=0.01)
+        try:
+            tmpdir.join('worker.ini').write('POOL = 16\n')
+            for _ in range(200):
+                if current.POOL == '16':
+                    break
+                time.sleep(0.01)
+            assert current.POOL == '16'
+        finally:
+            reader.unwatch()
+
+    def test_cache(self, tmpdir):
+        tmpdir.join('global.ini').write('POOL = 4\nURL = %(POOL)s\n')
+        tmpdir.join('worker.ini').write('SIZE = %(POOL)s0\n')
+        config.ConfigReader(basedir=[str(tmpdir)])
+        assert tmpdir.join('.global.ini.cache').check()
+
+        with mock.patch.object(config.CustomConfigObj, '_load',
+                               autospec=True,
+                               side_effect=config.CustomConfigObj._load) \
+                as parser:
+            reader = config.ConfigReader(basedir=[str(tmpdir)])
+            assert (reader.POOL, reader.URL) == ('4', '4')
+            assert not parser.called
+            # Local configurations are interpolated with the cached one.
+            assert reader.accessor('worker').SIZE == '40'
+
+            tmpdir.join('global.ini').write('POOL = 16\nURL = b\n')
+            reader = config.ConfigReader(basedir=[str(tmpdir)])
+            assert (reader.POOL, reader.URL) == ('16', 'b')
+
+        assert config.ConfigReader(basedir=[str(tmpdir)]).POOL == '16'
+
+    def test_views(self, tmpdir):
+        tmpdir.join('global.ini').write(
+            'NAME = x\n[pool]\nSIZE = 4\nHOSTS = a, b\n'
+            '[[retry]]\nDELAY = %(SIZE)s\n')
+        for _ in range(2):  # parsed, then loaded from the cache
+            reader = config.ConfigReader(basedir=[str(tmpdir)])
+            pool = reader.pool
+            assert isinstance(pool, config.ConfigView)
+            assert pool.SIZE == '4'
+            assert pool['HOSTS'] == ['a', 'b']
+            assert pool.retry.DELAY == '4'
+            assert dict(pool.retry) == {'DELAY': '4'}
+            assert reader.get('pool.retry.DELAY') == '4'
+            # The section is read, not copied.
+            assert pool._section is reader._main_config['pool']
+            with pytest.raises(AttributeError):
+                pool.SIZE = 8
+            with pytest.raises(AttributeError):
+                pool.MISSING
+
+    def test_load_is_bounded(self, tmpdir):
+        reader = config.ConfigReader(basedir=[str(tmpdir)])
+        reader.MAX_ON_DEMAND = 2
+        for name in 'abc':
+            tmpdir.join(name + '.ini').write('NAME = %s\n' % name)
+            assert reader.load(str(tmpdir.join(name + '.ini'))).NAME == name
+        assert [os.path.basename(path) for path in reader._on_demand] == [
+            'b.ini', 'c.ini']
+
+    def test_thread_local_caller(self):
+        here = os.path.dirname(__file__)
+        turns = {'local': threading.Event(), 'local2': threading.Event()}
+        other = {'local': 'local2', 'local2': 'local'}
+        results = {}
+
+        def run(name):
+            config_reader.update_local(name, os.path.join(here, name + '.ini'))
+            values = []
+            # the threads read in turn
+            for _ in range(5):
+                turns[name].wait()
+                turns[name].clear()
+                values.append(config_reader.get('OVERRIDEN'))
+                turns[other[name]].set()
+            results[name] = values
+
+        threads = [threading.Thread(target=run, args=(name,))
+                   for name in ('local', 'local2')]
+        for thread in threads:
+            thread.start()
+        turns['local'].set()
+        for thread in threads:
+            thread.join()
+
+        assert results == {'local': ['local'] * 5, 'local2': ['global'] * 5}
+
+    def test_scope(self):
+        with config_reader.scope('local'):
+            assert config_reader.get('OVERRIDEN') == 'local'
+            with config_reader.scope('local2'):
+                assert config_reader.get('OVERRIDEN') == 'global'
+                assert config_reader.get('string') == 'second'
+            assert config_reader.get('string') == 'global/local'
+
     def test_logger(self):
         """The WF logger should not affect other loggers."""
         from workflow import engine
@@ -9,6 +9,8 @@
 
 import os
 import sys
+import threading
+import time
 
 from collections import Iterable
 
@@ -17,11 +19,18 @@ import pytest
 
 from workflow.engine import HaltProcessing, TransitionActions
 from workflow.engine_db import (
+    BackgroundWriter,
+    DELETED,
     DbWorkflowEngine,
+    ErrorReporter,
     ObjectStatus,
     WorkflowStatus,
     DbProcessingFactory,
+    ResumedGroup,
+    TrackedObject,
+    TransactionPolicy,
 )
+from workflow.errors import WorkflowError
 from workflow.utils import classproperty
 
 
@@ -181,3 +190,596 @@ class TestWorkflowEngineDb(object):
             self.wfe.processing_factory.before_processing(self.wfe, [])
             assert self.wfe.save.call_count == 1
             assert self.wfe.save.call_args_list[0][0] == (WorkflowStatus.RUNNING,)
+
+
+class TransactionalDbObj(DummyDbObj):
+    def __init__(self, events):
+        super(TransactionalDbObj, self).__init__()
+        self.events = events
+
+    def save(self, status):
+        self.events.append(('eng', status))
+
+    def begin(self):
+        self.events.append('begin')
+
+    def commit(self):
+        self.events.append('commit')
+
+    def rollback(self):
+        self.events.append('rollback')
+
+
+class TransactionalToken(FakeToken):
+    def __init__(self, data, events):
+        super(TransactionalToken, self).__init__(data)
+        self.events = events
+        self.error_message = None
+
+    def save(self, status=None, callback_pos=None, id_workflow=None,
+             task_counter=None):
+        self.events.append((self.data, status))
+
+    def set_error_message(self, message):
+        self.error_message = message
+
+
+class TransactionalDbWorkflowEngine(DbWorkflowEngine):
+    def __init__(self, db_obj, **kwargs):
+        super(TransactionalDbWorkflowEngine, self).__init__(db_obj, **kwargs)
+        self.events = db_obj.events
+
+
+class TestTransactionPolicy(object):
+
+    def setup_method(self, method):
+        self.events = []
+        self.tokens = [TransactionalToken(x, self.events)
+                       for x in ('one', 'two', 'three', 'four', 'five')]
+
+    def engine(self, policy, callbacks=None):
+        wfe = TransactionalDbWorkflowEngine(
+            TransactionalDbObj(self.events), transaction_policy=policy
+        )
+        wfe.callbacks.add_many(callbacks or [lambda obj, eng: None])
+        return wfe
+
+    def test_no_policy_does_not_use_transactions(self):
+        self.engine(None).process(self.tokens)
+        assert 'begin' not in self.events
+        assert 'commit' not in self.events
+
+    def test_per_object_commits_every_object(self):
+        self.engine(TransactionPolicy.per_object()).process(self.tokens)
+        assert self.events.count('begin') == len(self.tokens) + 1
+        assert self.events.count('commit') == len(self.tokens) + 1
+        assert self.events[:5] == [
+            'begin',
+            ('eng', WorkflowStatus.RUNNING),
+            ('one', ObjectStatus.RUNNING),
+            ('one', ObjectStatus.COMPLETED),
+            'commit',
+        ]
+
+    def test_per_objects_commits_in_batches(self):
+        self.engine(TransactionPolicy.per_objects(2)).process(self.tokens)
+        # Two full batches, then the last object with the final engine save.
+        assert self.events.count('begin') == 3
+        assert self.events.count('commit') == 3
+        assert self.events[-3:] == [
+            ('five', ObjectStatus.COMPLETED),
+            ('eng', WorkflowStatus.COMPLETED),
+            'commit',
+        ]
+
+    def test_per_run_commits_once(self):
+        self.engine(TransactionPolicy.per_run()).process(self.tokens)
+        assert self.events.count('begin') == 1
+        assert self.events.count('commit') == 1
+        assert self.events[0] == 'begin'
+        assert self.events[-1] == 'commit'
+
+    def test_halt_commits_transaction(self):
+        wfe = self.engine(TransactionPolicy.per_run(),
+                          [lambda obj, eng: eng.halt('wait')])
+        with pytest.raises(HaltProcessing):
+            wfe.process(self.tokens)
+        assert self.events[-3:] == [
+            ('one', ObjectStatus.HALTED),
+            ('eng', WorkflowStatus.HALTED),
+            'commit',
+        ]
+        assert not wfe.transaction.active
+
+    def test_failed_batch_marks_only_offending_object(self):
+        def fail_on_three(obj, eng):
+            if obj.data == 'three':
+                raise ValueError('three')
+
+        wfe = self.engine(TransactionPolicy.per_run(), [fail_on_three])
+        with pytest.raises(WorkflowError):
+            wfe.process(self.tokens)
+
+        rollback = self.events.index('rollback')
+        assert self.events[rollback:] == [
+            'rollback',
+            'begin',
+            ('one', ObjectStatus.COMPLETED),
+            ('two', ObjectStatus.COMPLETED),
+            ('three', ObjectStatus.ERROR),
+            ('eng', WorkflowStatus.ERROR),
+            'commit',
+        ]
+        assert 'ValueError' in self.tokens[2].error_message
+        assert not wfe.transaction.active
+
+    def test_rolled_back_tracked_objects_are_saved_again(self):
+        def fail_on_three(obj, eng):
+            if obj.data == 'three':
+                raise ValueError('three')
+
+        wfe = self.engine(TransactionPolicy.per_run(), [fail_on_three])
+        with pytest.raises(WorkflowError):
+            wfe.process([TrackedObject(token) for token in self.tokens[:3]])
+
+        rollback = self.events.index('rollback')
+        assert self.events[rollback:] == [
+            'rollback',
+            'begin',
+            ('one', ObjectStatus.COMPLETED),
+            ('two', ObjectStatus.COMPLETED),
+            ('three', ObjectStatus.ERROR),
+            ('eng', WorkflowStatus.ERROR),
+            'commit',
+        ]
+
+    def test_unhandled_failure_rolls_back(self):
+        class BrokenToken(TransactionalToken):
+            def save(self, *args, **kwargs):
+                raise IOError('disk full')
+
+        wfe = self.engine(TransactionPolicy.per_run())
+        with pytest.raises(IOError):
+            wfe.process([BrokenToken('one', self.events)])
+        assert self.events[-1] == 'rollback'
+        assert not wfe.transaction.active
+
+    def test_invalid_batch_size(self):
+        with pytest.raises(ValueError):
+            TransactionPolicy.per_objects(0)
+
+
+class TestBackgroundWriter(object):
+
+    def setup_method(self, method):
+        self.events = []
+        self.tokens = [TransactionalToken(x, self.events)
+                       for x in ('one', 'two', 'three')]
+        self.writer = BackgroundWriter(maxsize=2)
+
+    def teardown_method(self, method):
+        self.writer.close()
+
+    def test_saves_run_on_writer_thread_in_order(self):
+        threads = set()
+
+        class ThreadRecordingToken(TransactionalToken):
+            def save(self, *args, **kwargs):
+                threads.add(threading.current_thread())
+                super(ThreadRecordingToken, self).save(*args, **kwargs)
+
+        tokens = [ThreadRecordingToken(x, self.events)
+                  for x in ('one', 'two', 'three')]
+        wfe = TransactionalDbWorkflowEngine(
+            TransactionalDbObj(self.events), writer=self.writer,
+            transaction_policy=TransactionPolicy.per_object()
+        )
+        wfe.callbacks.add_many([lambda obj, eng: None])
+        wfe.process(tokens)
+
+        # Everything has been written by the time `process` returns.
+        assert threading.current_thread() not in threads
+        assert [event for event in self.events
+                if isinstance(event, tuple) and event[0] == 'two'] == [
+            ('two', ObjectStatus.RUNNING),
+            ('two', ObjectStatus.COMPLETED),
+        ]
+        assert self.events[-1] == 'commit'
+
+    def test_process_flushes_before_reraising_halt(self):
+        wfe = TransactionalDbWorkflowEngine(
+            TransactionalDbObj(self.events), writer=self.writer
+        )
+        wfe.callbacks.add_many([lambda obj, eng: eng.halt('wait')])
+        with pytest.raises(HaltProcessing):
+            wfe.process(self.tokens)
+        assert self.events[-2:] == [
+            ('one', ObjectStatus.HALTED),
+            ('eng', WorkflowStatus.HALTED),
+        ]
+        assert self.writer.queue.unfinished_tasks == 0
+
+    def test_objects_are_not_changed_while_being_saved(self):
+        class SlowToken(TransactionalToken):
+            def __init__(self, data, events):
+                super(SlowToken, self).__init__(data, events)
+                self.extra_data = {}
+
+            def save(self, *args, **kwargs):
+                time.sleep(0.05)
+                self.events.append(dict(self.extra_data))
+
+        def add_key(obj, eng):
+            obj.extra_data['key'] = 'value'
+
+        wfe = TransactionalDbWorkflowEngine(
+            TransactionalDbObj(self.events), writer=self.writer
+        )
+        wfe.callbacks.add_many([add_key])
+        wfe.process([SlowToken('one', self.events)])
+
+        # The RUNNING save was written before the task ran.
+        assert self.events[1:] == [
+            {}, {'key': 'value'}, ('eng', WorkflowStatus.COMPLETED),
+        ]
+
+    def test_full_queue_blocks_submit(self):
+        release = threading.Event()
+        self.writer.submit(release.wait)
+        self.writer.submit(self.events.append, 'queued')
+        self.writer.submit(self.events.append, 'queued')
+
+        blocked = threading.Thread(
+            target=self.writer.submit, args=(self.events.append, 'blocked')
+        )
+        blocked.start()
+        blocked.join(0.1)
+        assert blocked.is_alive()
+
+        release.set()
+        blocked.join()
+        self.writer.flush()
+        assert self.events == ['queued', 'queued', 'blocked']
+
+    def test_errors_are_raised_on_flush(self):
+        def fail():
+            raise IOError('disk full')
+
+        self.writer.submit(fail)
+        self.writer.submit(self.events.append, 'discarded')
+        with pytest.raises(IOError):
+            self.writer.flush()
+        assert self.events == []
+
+        # The error is reported only once.
+        self.writer.submit(self.events.append, 'written')
+        self.writer.flush()
+        assert self.events == ['written']
+
+
+class PersistedToken(object):
+    def __init__(self, status=ObjectStatus.INITIAL):
+        self.status = status
+        self.callback_pos = None
+        self.id_workflow = None
+        self.data = {'title': 'one'}
+        self.extra_data = {}
+        self.saves = []
+
+    def save(self, status=None, callback_pos=None, id_workflow=None,
+             task_counter=None):
+        self.saves.append(status)
+        if status is not None:
+            self.status = status
+        if id_workflow is not None:
+            self.id_workflow = id_workflow
+        if task_counter is not None:
+            self.callback_pos = task_counter
+        if callback_pos is not None:
+            self.callback_pos = callback_pos
+
+    def set_error_message(self, message):
+        self.extra_data['_error_msg'] = message
+
+    @classproperty
+    def known_statuses(cls):
+        return ObjectStatus
+
+
+class TestTrackedObject(object):
+
+    def test_unchanged_save_is_noop(self):
+        token = PersistedToken(ObjectStatus.RUNNING)
+        tracked = TrackedObject(token)
+        tracked.save(status=ObjectStatus.RUNNING)
+        assert token.saves == []
+
+        tracked.save(status=ObjectStatus.COMPLETED, id_workflow='uuid')
+        tracked.save(status=ObjectStatus.COMPLETED, id_workflow='uuid')
+        assert token.saves == [ObjectStatus.COMPLETED]
+
+    def test_data_changes_are_saved(self):
+        token = PersistedToken(ObjectStatus.RUNNING)
+        tracked = TrackedObject(token)
+        tracked.extra_data['key'] = 'value'
+        assert tracked.changes(status=ObjectStatus.RUNNING) == {
+            'extra_data': set(['key'])
+        }
+        tracked.save(status=ObjectStatus.RUNNING)
+        assert token.saves == [ObjectStatus.RUNNING]
+        assert tracked.changes() == {}
+
+        tracked.data['title'] = 'two'
+        del tracked.extra_data['key']
+        assert tracked.changes() == {
+            'data': set(['title']),
+            'extra_data': set(['key']),
+        }
+
+    def test_partial_update(self):
+        token = PersistedToken(ObjectStatus.HALTED)
+        token.save_changes = mock.Mock()
+        tracked = TrackedObject(token)
+        tracked.extra_data['key'] = 'value'
+        tracked.save(status=ObjectStatus.RUNNING, id_workflow=None)
+        token.save_changes.assert_called_once_with({
+            'status': ObjectStatus.RUNNING,
+            'extra_data': {'key': 'value'},
+        })
+        assert token.saves == []
+
+        del tracked.extra_data['key']
+        tracked.save()
+        token.save_changes.assert_called_with({
+            'extra_data': {'key': DELETED},
+        })
+
+    def test_restarted_object_is_not_saved_again(self):
+        token = PersistedToken(ObjectStatus.HALTED)
+        wfe = DbWorkflowEngine(mock.Mock(spec=DummyDbObj()))
+        wfe.callbacks.add_many([lambda obj, eng: None])
+        wfe.process([TrackedObject(token)])
+        assert token.saves == [ObjectStatus.RUNNING, ObjectStatus.COMPLETED]
+
+        tracked = TrackedObject(token)
+        tracked.save(status=ObjectStatus.COMPLETED, id_workflow=wfe.uuid)
+        assert len(token.saves) == 2
+
+    def test_changes_are_computed_before_submitting_to_writer(self):
+        token = PersistedToken(ObjectStatus.HALTED)
+        token.save_changes = mock.Mock()
+        tracked = TrackedObject(token)
+        wfe = DbWorkflowEngine(mock.Mock(spec=DummyDbObj()),
+                               writer=mock.Mock())
+        tracked.extra_data['key'] = 'value'
+        wfe.persist_object(tracked, status=ObjectStatus.RUNNING)
+
+        # The engine keeps changing the object before the writer runs.
+        tracked.extra_data['other'] = 'value'
+        tracked.extra_data['key'] = 'changed'
+        (write,), _ = wfe.writer.submit.call_args
+        write()
+        token.save_changes.assert_called_once_with({
+            'status': ObjectStatus.RUNNING,
+            'extra_data': {'key': 'value'},
+        })
+        assert tracked.changes() == {'extra_data': set(['key', 'other'])}
+
+    def test_forgotten_object_is_saved_in_full(self):
+        token = PersistedToken(ObjectStatus.RUNNING)
+        token.save_changes = mock.Mock()
+        tracked = TrackedObject(token)
+        tracked.save(status=ObjectStatus.COMPLETED)
+        assert tracked.saves_copies
+
+        tracked.forget()
+        assert not tracked.saves_copies
+        assert tracked.changes(status=ObjectStatus.COMPLETED) == {
+            'status': ObjectStatus.COMPLETED,
+            'data': set(['title']),
+            'extra_data': set(),
+        }
+        tracked.save(status=ObjectStatus.COMPLETED)
+        assert token.saves == [ObjectStatus.COMPLETED]
+        assert token.save_changes.call_count == 1
+        assert tracked.changes(status=ObjectStatus.COMPLETED) == {}
+
+    def test_delegates_to_wrapped_object(self):
+        token = PersistedToken()
+        tracked = TrackedObject(token)
+        tracked.status = ObjectStatus.ERROR
+        assert token.status == ObjectStatus.ERROR
+        assert tracked.known_statuses is ObjectStatus
+        assert tracked
+
+
+class TestErrorReporter(object):
+
+    def setup_method(self, method):
+        self.events = []
+        self.reporter = ErrorReporter(window=60)
+
+    def engine(self, callbacks):
+        wfe = DbWorkflowEngine(TransactionalDbObj(self.events),
+                               error_reporter=self.reporter)
+        wfe.log = mock.Mock()
+        wfe.callbacks.add_many(callbacks)
+        return wfe
+
+    def test_identical_errors_are_logged_once(self):
+        def broken_service(obj, eng):
+            raise IOError('service unavailable')
+
+        tokens = [TransactionalToken(x, self.events) for x in range(5)]
+        wfe = self.engine([broken_service])
+        wfe.process(tokens, stop_on_error=False)
+
+        assert wfe.log.error.call_count == 1
+        assert 'service unavailable' in wfe.log.error.call_args[0][-1]
+        assert wfe.log.debug.call_count >= 4
+        for token in tokens:
+            assert 'service unavailable' in token.error_message
+
+    def test_fingerprint_depends_on_task(self):
+        def task_a(obj, eng):
+            raise IOError()
+
+        def task_b(obj, eng):
+            raise IOError()
+
+        for task in (task_a, task_b):
+            wfe = self.engine([task])
+            with pytest.raises(WorkflowError):
+                wfe.process([TransactionalToken('one', self.events)])
+        assert len(self.reporter._windows) == 2
+
+    def test_summary_after_window(self):
+        def broken_service(obj, eng):
+            raise IOError('service unavailable')
+
+        wfe = self.engine([broken_service])
+        with mock.patch('workflow.engine_db.time.time', return_value=0):
+            wfe.process([TransactionalToken(x, self.events)
+                         for x in range(3)], stop_on_error=False)
+        assert wfe.log.error.call_count == 1
+
+        with mock.patch('workflow.engine_db.time.time', return_value=61):
+            self.reporter.summarize(wfe.log)
+        assert wfe.log.error.call_count == 2
+        summary = wfe.log.error.call_args[0]
+        assert 'more time' in summary[0]
+        assert summary[3] == 2
+        assert self.reporter._windows == {}
+
+    def test_summary_when_errors_stop(self):
+        def broken_service(obj, eng):
+            if obj.data < 3:
+                raise IOError('service unavailable')
+
+        wfe = self.engine([broken_service])
+        tokens = [TransactionalToken(x, self.events) for x in range(5)]
+        with mock.patch('workflow.engine_db.time.time', return_value=0):
+            wfe.process(tokens[:3], stop_on_error=False)
+        assert wfe.log.error.call_count == 1
+
+        # The service is back: no error is reported anymore.
+        with mock.patch('workflow.engine_db.time.time', return_value=61):
+            wfe.process(tokens[3:])
+        assert wfe.log.error.call_count == 2
+        assert wfe.log.error.call_args[0][3] == 2
+
+    def test_summary_timer(self):
+        log = mock.Mock()
+        reporter = ErrorReporter(window=0.01)
+        try:
+            raise ValueError()
+        except ValueError:
+            exc_info = sys.exc_info()
+        for _ in range(3):
+            reporter.report(log, exc_info, 'traceback', task='task')
+        assert log.error.call_count == 1
+
+        # Nothing else is reported, the summary comes anyway.
+        for _ in range(100):
+            if log.error.call_count == 2:
+                break
+            time.sleep(0.01)
+        assert log.error.call_args[0][3] == 2
+        assert reporter._timer is None
+
+    def test_forced_summary(self):
+        log = mock.Mock()
+        try:
+            raise ValueError()
+        except ValueError:
+            exc_info = sys.exc_info()
+        for _ in range(3):
+            self.reporter.report(log, exc_info, 'traceback', task='task')
+        self.reporter.summarize(log, force=True)
+        assert log.error.call_count == 2
+
+
+class TestResumeHalted(object):
+
+    def setup_method(self, method):
+        self.tokens = [PersistedToken() for _ in range(5)]
+        for number, token in enumerate(self.tokens):
+            token.data = number
+        self.db_obj = mock.Mock(spec=DummyDbObj())
+        self.db_obj.objects = self.tokens
+        self.wfe = DbWorkflowEngine(self.db_obj)
+        self.ran = []
+
+    def task(self, name, halt_if=None):
+        def _task(obj, eng):
+            if halt_if and halt_if(obj) and not obj.extra_data.get(name):
+                obj.extra_data[name] = True
+                eng.halt('waiting')
+            self.ran.append((name, obj.data))
+        return _task
+
+    def test_resume_groups_by_position(self):
+        self.wfe.callbacks.add_many([
+            self.task('a'),
+            self.task('approve', halt_if=lambda obj: obj.data % 2),
+            self.task('b'),
+            self.task('review', halt_if=lambda obj: obj.data == 4),
+            self.task('c'),
+        ])
+        self.wfe.process(self.tokens, stop_on_halt=False)
+
+        assert [token.callback_pos for token in self.wfe.halted_objects] == [
+            [1], [1], [3]
+        ]
+
+        self.ran = []
+        results = self.wfe.resume_halted()
+
+        assert len(results) == 2
+        assert isinstance(results[0], ResumedGroup)
+        assert results[0].callback_pos == [2]
+        assert [obj.data for obj in results[0].completed] == [1, 3]
+        assert results[1].callback_pos == [4]
+        assert [obj.data for obj in results[1].completed] == [4]
+        assert self.ran == [
+            ('b', 1), ('review', 1), ('c', 1),
+            ('b', 3), ('review', 3), ('c', 3),
+            ('c', 4),
+        ]
+        assert self.wfe.halted_objects == []
+        assert self.wfe.resume_callback_pos is None
+
+    def test_resume_current_task(self):
+        self.wfe.callbacks.add_many([
+            self.task('a'),
+            self.task('approve', halt_if=lambda obj: obj.data < 2),
+        ])
+        self.wfe.process(self.tokens, stop_on_halt=False)
+
+        self.ran = []
+        results = self.wfe.resume_halted(task='current')
+        assert results[0].callback_pos == [1]
+        assert self.ran == [('approve', 0), ('approve', 1)]
+
+    def test_resume_reports_halted_and_errored_objects(self):
+        def fail_on_three(obj, eng):
+            if obj.data == 3:
+                raise ValueError()
+
+        self.wfe.callbacks.add_many([
+            self.task('approve', halt_if=lambda obj: obj.data > 1),
+            fail_on_three,
+            self.task('again', halt_if=lambda obj: obj.data == 4),
+        ])
+        self.wfe.process(self.tokens, stop_on_halt=False)
+
+        result, = self.wfe.resume_halted()
+        assert [obj.data for obj in result.completed] == [2]
+        assert [obj.data for obj in result.errored] == [3]
+        assert [obj.data for obj in result.halted] == [4]
+
+    def test_objects_without_position_are_skipped(self):
+        self.wfe.callbacks.add_many([self.task('a')])
+        self.tokens[0].status = ObjectStatus.HALTED
+        assert self.wfe.resume_halted() == []
+        assert self.ran == []
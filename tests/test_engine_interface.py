@@ -9,6 +9,8 @@
 
 import os
 import sys
+import threading
+import time
 from copy import deepcopy
 
 import mock
@@ -62,7 +64,8 @@ class TestSignals(object):
             getattr(signals, signal_name).send.assert_called_once_with()
 
     def test_log_warning_if_signals_lib_is_missing(self):
-        from workflow.engine import Signal
+        from workflow.engine import _Signal
+        Signal = _Signal()
 
         orig_import = __import__
 
@@ -85,6 +88,138 @@ class TestSignals(object):
                                                 "ignoring all future signal calls.")
 
 
+    def test_lifecycle_signals_are_sent_by_engine(self):
+        from workflow import signals
+
+        received = []
+
+        def receiver(name):
+            def _receiver(sender, **kwargs):
+                received.append((name, sender, kwargs['obj']))
+            return _receiver
+
+        receivers = [receiver(name) for name in
+                     ('object_started', 'object_finished', 'task_failed')]
+        signals.object_started.connect(receivers[0])
+        signals.object_finished.connect(receivers[1])
+        signals.task_failed.connect(receivers[2])
+
+        def fail_on_two(obj, eng):
+            if obj == [2]:
+                raise ValueError()
+
+        eng = GenericWorkflowEngine()
+        eng.callbacks.replace([fail_on_two])
+        try:
+            with pytest.raises(ValueError):
+                eng.process([[1], [2]])
+        finally:
+            signals.object_started.disconnect(receivers[0])
+            signals.object_finished.disconnect(receivers[1])
+            signals.task_failed.disconnect(receivers[2])
+
+        assert received == [
+            ('object_started', eng, [1]),
+            ('object_finished', eng, [1]),
+            ('object_started', eng, [2]),
+            ('task_failed', eng, [2]),
+        ]
+
+    def test_signals_without_receivers_are_not_sent(self):
+        from workflow import signals
+
+        eng = GenericWorkflowEngine()
+        eng.callbacks.replace([obj_append('x')])
+        with mock.patch.object(signals.object_started, 'send') as send:
+            eng.process([[]])
+        assert not send.called
+
+    def test_signals_module_is_resolved_once(self):
+        from workflow.engine import _Signal
+        from workflow import signals
+
+        signal = _Signal()
+        assert signal.signals() is signals
+        with mock.patch.dict(sys.modules, {'workflow.signals': None}):
+            assert signal.signals() is signals
+
+
+class TestSignalDispatcher(object):
+
+    def setup_method(self, method):
+        from workflow import signals
+        self.signal = signals.object_finished
+        self.received = []
+
+    def receiver(self, sender, **kwargs):
+        self.received.append(
+            (sender, kwargs['obj'], threading.current_thread())
+        )
+
+    def test_signals_are_delivered_in_order_on_another_thread(self):
+        from workflow.engine import _Signal, SignalDispatcher
+
+        signal = _Signal()
+        signal.dispatcher = SignalDispatcher()
+        self.signal.connect(self.receiver)
+        try:
+            for obj in range(10):
+                signal.object_finished('eng', obj=obj)
+            signal.dispatcher.close()
+        finally:
+            self.signal.disconnect(self.receiver)
+
+        assert [obj for _, obj, _ in self.received] == list(range(10))
+        assert all(thread is not threading.current_thread()
+                   for _, _, thread in self.received)
+
+    def test_drop_policy(self):
+        from workflow.engine import SignalDispatcher
+
+        release = threading.Event()
+        dispatcher = SignalDispatcher(maxsize=1, policy='drop')
+        dispatcher.dispatch(mock.Mock(send=lambda: release.wait()))
+        # Wait for the blocking signal to be taken from the queue.
+        while dispatcher.queue.qsize():
+            time.sleep(.01)
+        dispatcher.dispatch(self.signal, 'eng', obj=1)
+        dispatcher.dispatch(self.signal, 'eng', obj=2)
+        assert dispatcher.dropped == 1
+
+        release.set()
+        self.signal.connect(self.receiver)
+        try:
+            dispatcher.close()
+        finally:
+            self.signal.disconnect(self.receiver)
+        assert [obj for _, obj, _ in self.received] == [1]
+
+    def test_receiver_errors_are_logged(self):
+        from workflow.engine import SignalDispatcher
+
+        def broken_receiver(sender, **kwargs):
+            raise ValueError()
+
+        dispatcher = SignalDispatcher()
+        self.signal.connect(broken_receiver)
+        self.signal.connect(self.receiver)
+        try:
+            with mock.patch('workflow.engine.logging.getLogger') as logger:
+                dispatcher.dispatch(self.signal, 'eng', obj=1)
+                dispatcher.flush()
+        finally:
+            self.signal.disconnect(broken_receiver)
+            self.signal.disconnect(self.receiver)
+            dispatcher.close()
+        assert logger.return_value.exception.called
+
+    def test_invalid_policy(self):
+        from workflow.engine import SignalDispatcher
+
+        with pytest.raises(ValueError):
+            SignalDispatcher(policy='ignore')
+
+
 def TestMachineState(object):
 
     def test_machine_state_does_not_allow_token_pos_below_minus_one(self):
@@ -8,10 +8,15 @@
 # more details.
 
 import sys
+import functools
 import os
+import threading
 import time
 import random
 
+import mock
+import pytest
+
 p = os.path.abspath(os.path.dirname(__file__) + '/../')
 if p not in sys.path:
     sys.path.append(p)
@@ -39,6 +44,10 @@ def e(key, val):
     return _e
 
 
+def join(*args, **kwargs):
+    return list(args) + sorted(kwargs.items())
+
+
 def printer(val):
     def _printer(obj, eng):
         lock = eng.store['lock']
@@ -151,6 +160,83 @@ class TestGenericWorkflowEngine(object):
         assert r[3] == 'add four 4 44 forty end OK'
         assert r[4] == 'add five not-four end OK'
 
+    # -------------- loops ------------------
+
+    def test_FOR_callable(self):
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.FOR(lambda obj, eng: obj[:1] * 2, 'item',
+                               lambda obj, eng: obj.append(
+                                   eng.extra_data['item'].upper()))])
+        doc = self.getDoc('a b')
+        we.process(doc)
+
+        assert doc == [['a', 'A', 'A'], ['b', 'B', 'B']]
+
+    def test_FOR_EACH(self):
+        pulled = []
+
+        def items(obj, eng):
+            for item in range(3):
+                pulled.append(item)
+                yield item
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.FOR_EACH(items, 'item',
+                                    lambda obj, eng: obj.append(
+                                        eng.extra_data['item'])),
+                        a('end')])
+        doc = self.getDoc('a b')
+        we.process(doc)
+
+        assert doc == [['a', 0, 1, 2, 'end'], ['b', 0, 1, 2, 'end']]
+        # Every item is pulled once per object.
+        assert pulled == [0, 1, 2, 0, 1, 2]
+        assert we.extra_data['_Iterators'] == {}
+
+    def test_FOR_EACH_resume(self):
+        from workflow.errors import HaltProcessing
+
+        def halt_on_two(obj, eng):
+            obj.append(eng.extra_data['item'])
+            if eng.extra_data['item'] == 2 and 'resumed' not in obj:
+                obj.append('resumed')
+                eng.halt('two')
+
+        workflow = [cf.FOR_EACH(range(5), 'item', halt_on_two), a('end')]
+        we = GenericWorkflowEngine()
+        we.setWorkflow(workflow)
+        doc = self.getDoc('a')
+        with pytest.raises(HaltProcessing):
+            we.process(doc)
+        cursors = list(we.extra_data['_Iterators'].values())
+        assert cursors == [{'index': 3}]
+
+        # A new engine resumes from the stored cursor.
+        new_eng = GenericWorkflowEngine()
+        new_eng.setWorkflow(workflow)
+        new_eng.extra_data = we.extra_data
+        new_eng.state.token_pos = we.state.token_pos
+        new_eng.state.callback_pos = we.state.callback_pos
+        new_eng.restart('current', 'next', objects=doc)
+
+        assert doc == [['a', 0, 1, 2, 'resumed', 3, 4, 'end']]
+
+    def test_FOR_EACH_per_object(self):
+        def halt_on_a2(obj, eng):
+            obj.append(eng.extra_data['item'])
+            if eng.extra_data['item'] == 'a2':
+                eng.halt('a2')
+
+        def items(obj, eng):
+            return [obj[0] + str(n) for n in (1, 2, 3)]
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.FOR_EACH(items, 'item', halt_on_a2)])
+        doc = self.getDoc('a b')
+        we.process(doc, stop_on_halt=False)
+
+        assert doc == [['a', 'a1', 'a2'], ['b', 'b1', 'b2', 'b3']]
+
     # -------------- parallel split ------------------
 
     def test_PARALLEL_SPLIT01(self):
@@ -280,6 +366,180 @@ class TestGenericWorkflowEngine(object):
 
         assert d.count('ok-1') > 1
 
+    def test_PARALLEL_SPLIT_join(self):
+        we = GenericWorkflowEngine()
+        doc = self.getDoc()
+
+        we.setWorkflow([i('start'),
+                        cf.PARALLEL_SPLIT(printer('p1'),
+                                          [printer('p2'), printer('p3')],
+                                          join=True),
+                        a('end')])
+        we.process(doc)
+
+        for d in doc:
+            assert d[-1] == 'end'
+            assert d.count('p1') == d.count('p2') == d.count('p3') == 5
+
+    def test_PARALLEL_SPLIT_join_error(self):
+        def fail(obj, eng):
+            raise ValueError('branch failed')
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PARALLEL_SPLIT(a('ok'), fail, join=True),
+                        a('end')])
+        doc = self.getDoc()
+        with pytest.raises(ValueError):
+            we.process(doc)
+        assert doc[0] == ['one', 'ok']
+
+    def test_PARALLEL_SPLIT_bounded(self):
+        threads = set()
+
+        def record(obj, eng):
+            threads.add(threading.current_thread())
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PARALLEL_SPLIT(record, record, record)])
+        we.process(self.getDoc() * 100)
+        cf.get_executor().submit(lambda: None).result()
+
+        assert threading.current_thread() not in threads
+        assert len(threads) <= cf.MAX_WORKERS
+
+    def test_PARALLEL_SPLIT_backpressure(self):
+        release = threading.Event()
+
+        def wait(obj, eng):
+            release.wait()
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PARALLEL_SPLIT(wait)])
+        cf.get_executor()
+        with mock.patch.object(cf, '_pending', threading.BoundedSemaphore(2)):
+            thread = threading.Thread(target=we.process,
+                                      args=(self.getDoc(),))
+            thread.start()
+            thread.join(.2)
+            # The engine waits for room before submitting the third object.
+            assert thread.is_alive()
+            assert we.state.token_pos == 2
+            release.set()
+            thread.join()
+
+    # --------------- parallel map --------------------
+
+    def test_PARALLEL_MAP(self):
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PARALLEL_MAP(abs,
+                                        lambda obj, eng: obj['values'],
+                                        'results', chunksize=7)])
+        doc = [{'values': range(-50, 50)}, {'values': []}]
+        we.process(doc)
+
+        assert doc[0]['results'] == [abs(x) for x in range(-50, 50)]
+        assert doc[1]['results'] == []
+
+    def test_PARALLEL_MAP_setter(self):
+        def setter(obj, eng, results):
+            obj.extend(results)
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PARALLEL_MAP(len, lambda obj, eng: obj[:], setter)])
+        doc = self.getDoc('a bb ccc')
+        we.process(doc)
+
+        assert doc == [['a', 1], ['bb', 2], ['ccc', 3]]
+
+    # --------------- prefetching --------------------
+
+    def test_PREFETCH(self):
+        loaded = []
+
+        def loader(obj):
+            loaded.append((obj[0], threading.current_thread()))
+            return obj[0].upper()
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PREFETCH(loader, lambda obj, eng, data:
+                                    obj.append(data), ahead=2)])
+        doc = self.getDoc()
+        we.process(doc)
+
+        assert doc == [[x, x.upper()] for x in
+                       ['one', 'two', 'three', 'four', 'five']]
+        # Every object is loaded once, all but the first one in advance.
+        assert sorted(name for name, _ in loaded) == sorted(
+            ['one', 'two', 'three', 'four', 'five'])
+        threads = dict(loaded)
+        assert threads['one'] is threading.current_thread()
+        assert threads['two'] is not threading.current_thread()
+
+    def test_PREFETCH_errors(self):
+        def loader(obj):
+            if obj[0] == 'two':
+                raise IOError('not found')
+            return obj[0]
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.PREFETCH(loader, lambda obj, eng, data:
+                                    obj.append(data))])
+        doc = self.getDoc()
+        with pytest.raises(IOError):
+            we.process(doc)
+        assert doc[:2] == [['one', 'one'], ['two']]
+
+    # --------------- synchronization --------------------
+
+    def test_SYNCHRONIZE(self):
+        def sleep(seconds):
+            def _sleep(obj, eng):
+                time.sleep(seconds)
+                with lock:
+                    obj.append(seconds)
+            return _sleep
+
+        lock = threading.Lock()
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.SYNCHRONIZE(sleep(.2), sleep(.1),
+                                       [sleep(.15), a('branch')],
+                                       a('end'))])
+        doc = self.getDoc()[0:1]
+        start = time.time()
+        we.process(doc)
+
+        assert time.time() - start < .35
+        assert doc[0][1:] == [.1, .15, 'branch', .2, 'end']
+
+    def test_SYNCHRONIZE_pass_results(self):
+        def fail(obj, eng):
+            raise ValueError('branch failed')
+
+        def final(obj, eng, branches):
+            obj.append([branch.exception().__class__.__name__
+                        if branch.exception() else branch.result()
+                        for branch in branches])
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.SYNCHRONIZE(lambda obj, eng: 'x',
+                                       lambda obj, eng: 'y',
+                                       fail, final, pass_results=True)])
+        doc = self.getDoc()[0:1]
+        we.process(doc)
+
+        assert doc[0] == ['one', ['x', 'y', 'ValueError']]
+
+    def test_SYNCHRONIZE_error(self):
+        def fail(obj, eng):
+            raise ValueError('branch failed')
+
+        we = GenericWorkflowEngine()
+        we.setWorkflow([cf.SYNCHRONIZE(a('x'), fail, a('end'))])
+        doc = self.getDoc()[0:1]
+        with pytest.raises(ValueError):
+            we.process(doc)
+        assert doc[0] == ['one', 'x']
+
     # --------------- choice pattern --------------------
 
     def test_CHOICE01(self):
@@ -382,6 +642,305 @@ class TestGenericWorkflowEngine(object):
         assert 'end' in d
 
     # ------------------- testing RUN_WF -----------------------------
+    # --------------- helpers --------------------
+
+    def test_CMP(self):
+        get = ut.OBJ_GET('key')
+        obj = {'key': [1, 2]}
+        assert cf.CMP(get, [1, 2], '==')(obj, None)
+        assert cf.CMP(get, [1, 3], 'lt')(obj, None)
+        assert cf.CMP(get, 2, 'in')(obj, None)
+        assert not cf.CMP(get, 3, 'in')(obj, None)
+        with pytest.raises(KeyError):
+            cf.CMP(get, 3, 'contains')
+
+    def test_nice_docs(self):
+        branch = cf.IF(lambda obj, eng: True, [a('x')] * 1000)
+        assert branch[0].__doc__ == (
+            "IF: args(<lambda>, list<1000 items>); kwargs()."
+        )
+        task = cf.CMP(ut.OBJ_GET('key'), 'x' * 100, '<', comment='short')
+        assert task.__doc__ == 'short'
+
+    def test_OBJ_GET_paths(self):
+        obj = {'metadata': {'authors': [{'name': 'Ellis'}], 'title': ''},
+               'a.b': 1}
+        assert ut.OBJ_GET('metadata.authors[0].name')(obj, None) == 'Ellis'
+        assert ut.OBJ_GET('metadata.authors[1].name')(obj, None) is False
+        assert ut.OBJ_GET('metadata.title.x')(obj, None) is False
+        assert ut.OBJ_GET('["a.b"]')(obj, None) == 1
+
+        paths = ['metadata.authors[0].name', 'metadata.title']
+        assert ut.OBJ_GET(paths, 'any')(obj, None) == 'Ellis'
+        assert ut.OBJ_GET(paths, 'MANY')(obj, None) == {
+            'metadata.authors[0].name': 'Ellis'}
+        assert ut.OBJ_GET(paths)(obj, None) is False
+
+        with pytest.raises(ValueError):
+            ut.OBJ_GET('metadata..title')
+
+    def test_OBJ_SET_paths(self):
+        obj = {'metadata': {'authors': [{}]}}
+        ut.OBJ_SET('metadata.authors[0].name', 'Ellis')(obj, None)
+        assert obj == {'metadata': {'authors': [{'name': 'Ellis'}]}}
+
+        we = GenericWorkflowEngine()
+        ut.ENG_SET('counts', {})(None, we)
+        ut.ENG_SET('counts.objects', 2)(None, we)
+        assert ut.ENG_GET('counts.objects')(None, we) == 2
+        assert ut.ENG_GET('counts.missing')(None, we) is None
+
+    def test_OBJ_EXTRACT(self):
+        obj = mock.MagicMock()
+        obj.__getitem__.side_effect = {'metadata': {
+            'title': 'Workflow', 'authors': [{'name': 'Ellis'}]}}.__getitem__
+        extract = ut.OBJ_EXTRACT(['metadata.title', 'metadata.authors[0].name',
+                                  'metadata.year', 'id'], default='?')
+        assert extract(obj, None) == {
+            'metadata.title': 'Workflow',
+            'metadata.authors[0].name': 'Ellis',
+            'metadata.year': '?',
+            'id': '?',
+        }
+        # The common prefix was only looked up once.
+        assert obj.__getitem__.call_count == 2
+
+    def test_CIRCUIT_BREAKER(self):
+        from workflow.errors import CircuitOpenError, HaltProcessing
+
+        calls = []
+
+        def backend(obj, eng):
+            calls.append(obj[0])
+            if 'fail' in obj:
+                raise IOError('backend down')
+
+        breaker = ut.CircuitBreaker('backend', threshold=2, cooldown=60)
+        we = GenericWorkflowEngine()
+        we.setWorkflow([ut.CIRCUIT_BREAKER(backend, breaker,
+                                           on_open='error')])
+        doc = [['a', 'fail'], ['b', 'fail'], ['c']]
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=0):
+            for obj in doc[:2]:
+                with pytest.raises(IOError):
+                    we.process([obj])
+            assert breaker.state == breaker.OPEN
+            # Objects fail fast while the circuit is open.
+            with pytest.raises(CircuitOpenError):
+                we.process([doc[2]])
+        assert calls == ['a', 'b']
+
+        # After the cool-down, a successful trial call closes the circuit.
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=61):
+            we.process([doc[2]])
+        assert calls == ['a', 'b', 'c']
+        assert breaker.state == breaker.CLOSED
+
+        we.setWorkflow([ut.CIRCUIT_BREAKER(backend, breaker)])
+        breaker.failure()
+        breaker.failure()
+        with pytest.raises(HaltProcessing) as excinfo:
+            we.process([['d']])
+        assert excinfo.value.payload == {'breaker': 'backend',
+                                         'retry_at': breaker.retry_at}
+
+    def test_CIRCUIT_BREAKER_half_open(self):
+        breaker = ut.CircuitBreaker('half-open', threshold=1, cooldown=10)
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=0):
+            breaker.failure()
+            assert not breaker.allow()
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=10):
+            assert breaker.allow()
+            # Only one trial call at a time.
+            assert not breaker.allow()
+            breaker.failure()
+            assert breaker.state == breaker.OPEN
+            assert not breaker.allow()
+
+    def test_CIRCUIT_BREAKER_uncounted_trial_error(self):
+        errors = [IOError('down'), KeyError('bug')]
+
+        def backend(obj, eng):
+            if errors:
+                raise errors.pop(0)
+            obj.append('called')
+
+        breaker = ut.CircuitBreaker('uncounted', threshold=1, cooldown=0)
+        task = ut.CIRCUIT_BREAKER(backend, breaker, failures=IOError)
+        with pytest.raises(IOError):
+            task(['a'], None)
+        assert breaker.state == breaker.OPEN
+        # The trial call fails with an error that is not counted.
+        with pytest.raises(KeyError):
+            task(['b'], None)
+        assert breaker.state == breaker.HALF_OPEN
+
+        # The next call is a new trial, and closes the circuit.
+        obj = ['c']
+        task(obj, None)
+        assert obj == ['c', 'called']
+        assert breaker.state == breaker.CLOSED
+
+    def test_CIRCUIT_BREAKER_is_shared(self):
+        assert ut.CircuitBreaker.get('shared') is \
+            ut.CircuitBreaker.get('shared', threshold=1)
+
+    def test_MEMOIZE(self):
+        calls = []
+
+        def normalize(obj, eng):
+            calls.append(obj[0])
+            return obj[0].upper()
+
+        cache = ut.MemoCache('normalize', maxsize=2, ttl=60)
+        memoized = ut.MEMOIZE(normalize, lambda obj, eng: obj[0], cache)
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=0):
+            assert [memoized([x], None) for x in 'aabac'] == list('AABAC')
+        assert calls == ['a', 'b', 'c']
+        assert (cache.hits, cache.misses) == (2, 3)
+        # 'b' was evicted as the least recently used result.
+        assert list(cache._results) == ['a', 'c']
+
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=61):
+            assert memoized(['a'], None) == 'A'
+        assert calls == ['a', 'b', 'c', 'a']
+
+    def test_MEMOIZE_is_shared(self):
+        def task(obj, eng):
+            return obj[0]
+
+        first = ut.MEMOIZE(task, lambda obj, eng: obj[0], 'task')
+        second = ut.MEMOIZE(task, lambda obj, eng: obj[0], 'task')
+        assert first.cache is second.cache
+
+    def test_MEMOIZE_default_cache_is_private(self):
+        first = ut.MEMOIZE(lambda obj, eng: 'first', lambda obj, eng: 1)
+        second = ut.MEMOIZE(lambda obj, eng: 'second', lambda obj, eng: 1)
+        assert first([], None) == 'first'
+        assert second([], None) == 'second'
+
+        def add(value, obj, eng):
+            return obj[0] + value
+
+        memoized = ut.MEMOIZE(functools.partial(add, 1),
+                              lambda obj, eng: obj[0])
+        assert memoized.cache.name == 'partial'
+        assert memoized([1], None) == 2
+
+    @pytest.mark.parametrize('backend', [ut.SQLiteMemoBackend,
+                                         ut.DbmMemoBackend])
+    def test_MEMOIZE_persistent_backend(self, backend, tmpdir):
+        path = str(tmpdir.join('memo'))
+        calls = []
+
+        def lookup(obj, eng):
+            calls.append(obj)
+            return {'affiliation': obj[0]}
+
+        cache = ut.MemoCache('lookup', backend=backend(path))
+        assert ut.MEMOIZE(lookup, lambda obj, eng: obj[0], cache)(
+            ['CERN'], None) == {'affiliation': 'CERN'}
+        cache.backend.close()
+
+        # A new process finds the result in the backend.
+        cache = ut.MemoCache('lookup', backend=backend(path))
+        assert ut.MEMOIZE(lookup, lambda obj, eng: obj[0], cache)(
+            ['CERN'], None) == {'affiliation': 'CERN'}
+        assert len(calls) == 1
+        assert cache.hits == 1
+
+    def test_TokenBucket(self):
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=0):
+            bucket = ut.TokenBucket(rate=2, burst=2)
+            assert [bucket.reserve() for _ in range(4)] == [0, 0, .5, 1]
+            assert bucket.reserve(max_wait=1) is None
+        with mock.patch('workflow.patterns.utils.time.time',
+                        return_value=10):
+            # Tokens do not accumulate beyond the burst.
+            assert [bucket.reserve() for _ in range(3)] == [0, 0, .5]
+
+    def test_RATE_LIMIT(self):
+        from workflow.errors import HaltProcessing
+
+        calls = []
+        limiter = ut.RateLimiter('api', rate=10, burst=1)
+        we = GenericWorkflowEngine()
+        we.setWorkflow([ut.RATE_LIMIT(lambda obj, eng: calls.append(obj[0]),
+                                      limiter, key=lambda obj, eng: obj[1])])
+        with mock.patch('workflow.patterns.utils.time.sleep') as sleep:
+            we.process([['a', 'host-1'], ['b', 'host-1'], ['c', 'host-2']])
+        assert calls == ['a', 'b', 'c']
+        # Only the second call to host-1 had to wait for a token.
+        assert sleep.call_count == 1
+        assert 0 < sleep.call_args[0][0] <= .1
+
+        we.setWorkflow([ut.RATE_LIMIT(lambda obj, eng: calls.append(obj[0]),
+                                      limiter, timeout=0)])
+        we.process([['d']])
+        with pytest.raises(HaltProcessing) as excinfo:
+            we.process([['e']])
+        assert excinfo.value.payload == {'limiter': 'api', 'key': None}
+
+    def test_RATE_LIMIT_is_shared(self):
+        assert ut.RateLimiter.get('shared', rate=1) is \
+            ut.RateLimiter.get('shared', rate=2)
+
+    def test_PROFILE_aggregate(self, tmpdir):
+        import pstats
+        output = str(tmpdir.join('run.prof'))
+
+        def slow_task(obj, eng):
+            sum(range(100000))
+            obj.append('slow')
+
+        flow = [ut.PROFILE(slow_task, output, aggregate=True),
+                ut.PROFILE([a('sub')], output, aggregate=True)]
+        for _ in range(2):
+            we = GenericWorkflowEngine()
+            we.setWorkflow(flow)
+            we.process(self.getDoc('one two'))
+
+        assert not os.path.exists(output)
+        ut.ProfileAggregator.get(output).dump()
+
+        stats = pstats.Stats(output)
+        calls = [value[1] for key, value in stats.stats.items()
+                 if key[2] == 'slow_task']
+        assert calls == [4]
+        with open(output + '.collapsed') as collapsed:
+            stacks = [line.rsplit(' ', 1)[0].split(';') for line in collapsed]
+        assert ['task 0', 'slow_task'] in [s[1:3] for s in stacks]
+        assert ['task 1', 'workflow'] in [s[1:3] for s in stacks]
+
+    def test_CALLFUNC(self):
+        we = GenericWorkflowEngine()
+        we.extra_data['sep'] = '-'
+        we.setWorkflow([ut.CALLFUNC(join, 'out', args=['first'],
+                                    oeargs=['Oname', 'Esep', 'name'],
+                                    ekeys={'e': 'sep'}, okeys={'o': 'name'},
+                                    k='v')])
+        doc = [{'name': 'a'}, {'name': 'b'}]
+        we.process(doc)
+
+        # Arguments are built afresh for every object.
+        assert doc[0]['out'] == ['first', 'a', '-', 'a',
+                                 ('e', '-'), ('k', 'v'), ('o', 'a')]
+        assert doc[1]['out'] == ['first', 'b', '-', 'b',
+                                 ('e', '-'), ('k', 'v'), ('o', 'b')]
+
+    def test_CALLFUNC_missing_key(self):
+        we = GenericWorkflowEngine()
+        we.setWorkflow([ut.CALLFUNC(join, oeargs=['Emissing'])])
+        with pytest.raises(KeyError):
+            we.process([{}])
+
     def test_RUN_WF01(self):
         """Test wfe is reinit=False, eng must remember previous invocations"""
         we = GenericWorkflowEngine()
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Workflow.
+# Copyright (C) 2018 CERN.
+#
+# Workflow is free software; you can redistribute it and/or modify it
+# under the terms of the Revised BSD License; see LICENSE file for
+# more details.
+
+"""Distribute workflow objects between workers through an SQLite file.
+
+Several worker processes, possibly on several hosts sharing the file, can
+process the objects of one workflow without an external broker: objects are
+claimed in batches with a lease that the worker renews while processing, and
+the lease of a worker that died expires so that its objects are claimed
+again by another one.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from .engine_db import ObjectStatus
+
+log = logging.getLogger('workflow.claims')
+
+
+class SQLiteClaimQueue(object):
+    """Queue of the objects of a workflow, stored in an SQLite file.
+
+    The queue only stores identifiers and statuses of the objects, which
+    themselves stay in the persistence layer of the workflow. An object is
+    ``ready`` when it can be claimed, ``leased`` while a worker owns it and
+    ``done`` once it has been processed.
+    """
+
+    def __init__(self, path, workflow, lease=300, timeout=30):
+        """Instantiate a new SQLiteClaimQueue object.
+
+        :param path: path of the SQLite file, created if needed.
+        :param workflow: name of the workflow the objects belong to.
+        :param lease: number of seconds a claim lasts without a heartbeat.
+        :param timeout: number of seconds to wait for the database lock.
+        """
+        self.path = path
+        self.workflow = workflow
+        self.lease = lease
+        self.timeout = timeout
+        with self._transaction() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS workflow_claims ('
+                ' workflow TEXT NOT NULL,'
+                ' id_object TEXT NOT NULL,'
+                ' status INTEGER NOT NULL,'
+                ' state TEXT NOT NULL,'
+                ' owner TEXT,'
+                ' lease_expires REAL,'
+                ' PRIMARY KEY (workflow, id_object))'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS workflow_claims_state '
+                'ON workflow_claims (workflow, state, lease_expires)'
+            )
+
+    @contextmanager
+    def _transaction(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout,
+                             isolation_level=None)
+        try:
+            # Take the write lock upfront so that claims are atomic.
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def add(self, ids, status=ObjectStatus.INITIAL):
+        """Make the objects `ids` ready to be claimed.
+
+        Objects already in the queue are made ready again with the new
+        `status`, for instance to resume halted objects, unless a worker
+        currently holds them.
+
+        :return: the identifiers left untouched because they are leased.
+        """
+        leased = []
+        with self._transaction() as db:
+            for id_object in ids:
+                values = (self.workflow, str(id_object), status.value)
+                cursor = db.execute(
+                    'INSERT OR IGNORE INTO workflow_claims '
+                    '(workflow, id_object, status, state, owner, '
+                    'lease_expires) '
+                    "VALUES (?, ?, ?, 'ready', NULL, NULL)", values
+                )
+                if cursor.rowcount:
+                    continue
+                cursor = db.execute(
+                    "UPDATE workflow_claims SET status = ?, state = 'ready', "
+                    'owner = NULL, lease_expires = NULL '
+                    "WHERE workflow = ? AND id_object = ? "
+                    "AND state != 'leased'",
+                    (status.value, self.workflow, str(id_object))
+                )
+                if not cursor.rowcount:
+                    leased.append(str(id_object))
+        return leased
+
+    def claim(self, worker, limit):
+        """Claim up to `limit` ready objects, or objects with expired leases.
+
+        :return: list of ``(id_object, status)`` tuples.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                'SELECT id_object, status FROM workflow_claims '
+                "WHERE workflow = ? AND (state = 'ready' OR "
+                "(state = 'leased' AND lease_expires < ?)) "
+                'ORDER BY rowid LIMIT ?',
+                (self.workflow, now, limit)
+            ).fetchall()
+            db.executemany(
+                "UPDATE workflow_claims SET state = 'leased', owner = ?, "
+                'lease_expires = ? WHERE workflow = ? AND id_object = ?',
+                [(worker, now + self.lease, self.workflow, id_object)
+                 for id_object, _ in rows]
+            )
+        return [(id_object, ObjectStatus(status))
+                for id_object, status in rows]
+
+    def heartbeat(self, worker, ids):
+        """Extend the lease of the objects `ids` still owned by `worker`.
+
+        :return: the identifiers whose lease was extended.
+        """
+        return self._update_owned(
+            worker, ids, "lease_expires = ?", (time.time() + self.lease,)
+        )
+
+    def release(self, worker, ids):
+        """Make the objects `ids` owned by `worker` ready again."""
+        return self._update_owned(
+            worker, ids,
+            "state = 'ready', owner = NULL, lease_expires = NULL", ()
+        )
+
+    def complete(self, worker, statuses):
+        """Record the outcome of the processing of objects owned by `worker`.
+
+        :param statuses: dict of object statuses, keyed by identifier.
+        :return: the identifiers whose outcome was recorded.
+        """
+        completed = []
+        with self._transaction() as db:
+            for id_object, status in statuses.items():
+                cursor = db.execute(
+                    "UPDATE workflow_claims SET state = 'done', status = ?, "
+                    'owner = NULL, lease_expires = NULL '
+                    "WHERE workflow = ? AND id_object = ? AND owner = ? "
+                    "AND state = 'leased'",
+                    (getattr(status, 'value', status), self.workflow,
+                     str(id_object), worker)
+                )
+                if cursor.rowcount:
+                    completed.append(str(id_object))
+        return completed
+
+    def counts(self):
+        """Return the number of objects in every state."""
+        with self._transaction() as db:
+            return dict(db.execute(
+                'SELECT state, COUNT(*) FROM workflow_claims '
+                'WHERE workflow = ? GROUP BY state', (self.workflow,)
+            ).fetchall())
+
+    def _update_owned(self, worker, ids, assignments, values):
+        updated = []
+        with self._transaction() as db:
+            for id_object in ids:
+                cursor = db.execute(
+                    'UPDATE workflow_claims SET ' + assignments +
+                    ' WHERE workflow = ? AND id_object = ? AND owner = ? '
+                    "AND state = 'leased'",
+                    values + (self.workflow, str(id_object), worker)
+                )
+                if cursor.rowcount:
+                    updated.append(str(id_object))
+        return updated
+
+
+class ClaimWorker(object):
+    """Process the objects claimed from a `SQLiteClaimQueue`.
+
+    New objects are processed from the first task, halted ones are resumed
+    with `DbWorkflowEngine.resume_halted`. The lease of the claimed objects
+    is renewed in the background while they are processed.
+    """
+
+    def __init__(self, queue, engine_factory, loader, name=None,
+                 batch_size=100, heartbeat=None):
+        """Instantiate a new ClaimWorker object.
+
+        :param queue: the queue to claim objects from.
+        :type queue: SQLiteClaimQueue
+        :param engine_factory: callable returning a new `DbWorkflowEngine`.
+        :param loader: callable returning the objects for a list of
+            identifiers; objects must expose their identifier as ``id``.
+        :param name: unique name of the worker.
+        :param batch_size: number of objects claimed at once.
+        :param heartbeat: number of seconds between lease renewals, by
+            default a third of the lease.
+        """
+        self.queue = queue
+        self.engine_factory = engine_factory
+        self.loader = loader
+        self.name = name or '%s-%s-%s' % (socket.gethostname(), os.getpid(),
+                                          uuid.uuid4().hex[:8])
+        self.batch_size = batch_size
+        self.heartbeat = heartbeat or queue.lease / 3.0
+        self.lost = []
+
+    def run_once(self):
+        """Claim and process one batch of objects.
+
+        Objects whose lease expired before their outcome could be recorded,
+        and which may therefore have been claimed by another worker, are
+        logged and added to `lost`.
+
+        :return: number of objects claimed.
+        """
+        claimed = self.queue.claim(self.name, self.batch_size)
+        if not claimed:
+            return 0
+        ids = [id_object for id_object, _ in claimed]
+        halted = set(id_object for id_object, status in claimed
+                     if status == ObjectStatus.HALTED)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat,
+                                     args=(list(ids), stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        statuses = {}
+        try:
+            objects = self.loader(ids)
+            new_objects = [obj for obj in objects
+                           if str(obj.id) not in halted]
+            halted_objects = [obj for obj in objects
+                              if str(obj.id) in halted]
+            eng = self.engine_factory()
+            if new_objects:
+                eng.process(new_objects, stop_on_error=False,
+                            stop_on_halt=False)
+            if halted_objects:
+                eng.resume_halted(halted_objects)
+            for obj in objects:
+                statuses[str(obj.id)] = obj.status
+        finally:
+            stop.set()
+            heartbeat.join()
+            completed = self.queue.complete(self.name, statuses)
+            self._lost(set(statuses) - set(completed))
+            self.queue.release(
+                self.name, [i for i in ids if i not in statuses]
+            )
+        return len(claimed)
+
+    def run(self, stop=None):
+        """Process batches until the queue is empty or `stop` is set.
+
+        :param stop: optional `threading.Event` to stop the worker.
+        """
+        while not (stop and stop.is_set()):
+            if not self.run_once():
+                break
+
+    def _heartbeat(self, ids, stop):
+        while ids and not stop.wait(self.heartbeat):
+            try:
+                renewed = self.queue.heartbeat(self.name, ids)
+            except sqlite3.Error:
+                log.exception("Worker %s could not renew its leases.",
+                              self.name)
+                continue
+            if len(renewed) < len(ids):
+                log.warning(
+                    "Worker %s lost the lease of objects %s, which may "
+                    "be processed by another worker.", self.name,
+                    ', '.join(sorted(set(ids) - set(renewed)))
+                )
+                ids[:] = renewed
+
+    def _lost(self, ids):
+        if ids:
+            log.error(
+                "Worker %s processed objects %s after losing their lease; "
+                "their outcome was not recorded.", self.name,
+                ', '.join(sorted(ids))
+            )
+            self.lost.extend(sorted(ids))
@@ -15,12 +15,35 @@ should be initialized (from the project root) with the path of the folder where
 configuration files live.
 """
 
+import contextlib
 import inspect
+import logging
 import os
 import sys
+import threading
 import traceback
+from collections import OrderedDict
 
 from configobj import Section, OPTION_DEFAULTS, ConfigObjError, ConfigObj
+from six.moves import cPickle as pickle
+from six.moves.collections_abc import Mapping
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
+
+
+log = logging.getLogger('workflow.config')
+
+
+def _stamp(path):
+    """Return the modification time and size of a file, None if missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
 
 
 class CustomConfigObj(ConfigObj):
@@ -83,6 +106,39 @@ class CustomConfigObj(ConfigObj):
         self._load(infile, configspec)
 
 
+class _ThreadLocalVar(threading.local):
+
+    """Thread-local stand-in for :class:`contextvars.ContextVar`."""
+
+    def __init__(self, name, default=None):
+        """Set the value returned until another one is set."""
+        self.default = default
+
+    def get(self):
+        """Return the value of the current thread."""
+        return getattr(self, 'value', self.default)
+
+    def set(self, value):
+        """Set the value of the current thread."""
+        self.value = value
+
+
+class _ConfigSnapshot(object):
+
+    """Configuration read by :class:`ConfigReader`, replaced as a whole."""
+
+    def __init__(self, main_config=None, global_values=None, sources=None):
+        """Initialize the snapshot with the main configuration values."""
+        self.main_config = main_config
+        self.global_values = global_values or {}
+        # main configuration files (and their replaced keys), in order
+        self.sources = OrderedDict(sources or ())
+        # local configurations, by module name
+        self.locals = {}
+        # stamps of the files read, see `_stamp`
+        self.stamps = {}
+
+
 class ConfigReader(object):
 
     """Facilitate easy reading/access to the INI style configuration.
@@ -119,21 +175,54 @@ class ConfigReader(object):
     You can pass a list of basedir folders - in that case, only the last one
     will be used for lookup of local configurations, but the global values will
     be inherited from all global.ini files found in the basedir folders.
+
+    The local configuration of every module is loaded once and kept until the
+    global configuration is updated, so modules reading the reader in turn do
+    not reload their files. Modules reading many values can also get an
+    accessor, which does not need to find out who the caller is:
+
+    .. code-block:: python
+
+        from workflow.config import config_reader
+        config = config_reader.accessor()
+        config.LOCAL_VALUE
+
+    Long-running processes can call :meth:`ConfigReader.watch` to reload the
+    configuration when its files change.
+
+    The recent caller is remembered per thread (and per asyncio task, where
+    ``contextvars`` is available), so that engines running different
+    workflows concurrently do not read the configuration of each other.
+
+    With ``caching`` enabled, the global configuration read when the reader is
+    created is also saved, compiled, to a ``.global.ini.cache`` file next to
+    the last ``global.ini``; it is loaded from there, in one read, as long as
+    the modification times and sizes of the files did not change.
     """
 
+    CACHE_FILENAME = '.global.ini.cache'
+    CACHE_VERSION = 2
+    MAX_ON_DEMAND = 128
+
     def __init__(self, basedir=os.path.abspath(os.path.dirname(__file__)),
                  caching=True):
         """Initialize configuration reader."""
         object.__init__(self)
-        self._local = {}
-        self._global = {}
-        self._on_demand = {}
-        self._recent_caller = ''
+        self._snapshot = _ConfigSnapshot()
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._local_files = {}
+        self._callers = {}
+        self._on_demand = OrderedDict()
+        if contextvars is not None:
+            self._caller = contextvars.ContextVar('workflow_config_caller',
+                                                  default='')
+        else:
+            self._caller = _ThreadLocalVar('workflow_config_caller', '')
         self._caching = caching
-        self._main_config = None
         self._basedir = []
 
-        self.setBasedir(basedir)
+        self._setBasedir(basedir)
 
         # load configurations
         if isinstance(basedir, list) or isinstance(basedir, tuple):
@@ -142,9 +231,32 @@ class ConfigReader(object):
                 if os.path.exists(d):
                     files.append(
                         os.path.abspath(os.path.join(d, 'global.ini')))
-            self.update(files)
         else:
-            self.update()
+            files = self._makeAllConfigPaths('global')
+        if not (caching and self._load_cache(files)):
+            self.update(files)
+            if caching:
+                self._save_cache(files)
+
+    @property
+    def _main_config(self):
+        return self._snapshot.main_config
+
+    @property
+    def _global(self):
+        return self._snapshot.global_values
+
+    @property
+    def _local(self):
+        return self._get_local(self._recent_caller)
+
+    @property
+    def _recent_caller(self):
+        return self._caller.get()
+
+    @_recent_caller.setter
+    def _recent_caller(self, name):
+        self._caller.set(name)
 
     def __getattr__(self, key):
         """Return configuration value.
@@ -156,33 +268,82 @@ class ConfigReader(object):
         frame = inspect.currentframe().f_back
 
         # TODO - make it try the hierarchy first?
-        if frame:
-            cfile = self._getCallerPath(frame)
-            if cfile:
-                caller = self._getCallerName(cfile)
-                if caller != self._recent_caller:
-                    # TODO: make it optional, allow for read-once-updates
-                    self.update_local(caller)  # update config
-
-        if key in self._local:
-            return self._local[key]
-        elif key in self._global:
-            return self._global[key]  # raise error ok
+        caller = frame and self._getCallerId(frame)
+        if caller:
+            if caller != self._caller.get():
+                self._caller.set(caller)
         else:
-            global_cfg_path = self._main_config and os.path.abspath(
-                self._main_config.filename) or 'None'
-            local_cfg_path = self._findConfigPath(self._recent_caller)
+            caller = self._caller.get()
+
+        snapshot = self._snapshot
+        local = snapshot.locals.get(caller)
+        if local is None:
+            local = self._get_local(caller, snapshot)
+        if key in local:
+            return local[key]
+        elif key in snapshot.global_values:
+            return snapshot.global_values[key]  # raise error ok
+        else:
+            global_cfg_path = snapshot.main_config and os.path.abspath(
+                snapshot.main_config.filename) or 'None'
+            local_cfg_path = self._findConfigPath(caller)
             raise AttributeError(
                 'Attribute "%s" not defined\n'
                 'global_config: %s\nlocal_config: %s' % (
                     key, global_cfg_path, local_cfg_path))
 
+    @contextlib.contextmanager
+    def scope(self, name):
+        """Read the local configuration of `name` inside a block.
+
+        It applies to the current thread (or asyncio task) only, and to the
+        values which are not read directly by a module having a
+        configuration itself, such as the ones read with :meth:`get`.
+
+        .. code-block:: python
+
+            with config_reader.scope('harvest'):
+                config_reader.get('pool.size')
+
+        :param name: name of the module (without suffix)
+        """
+        previous = self._caller.get()
+        self._caller.set(name)
+        try:
+            yield self
+        finally:
+            self._caller.set(previous)
+
     def _getCallerId(self, frame):
         if frame:
+            filename = frame.f_code.co_filename
+            try:
+                return self._callers[filename]
+            except KeyError:
+                pass
+            caller = None
             cfile = self._getCallerPath(frame)
             if cfile:
                 caller = self._getCallerName(cfile)
-                return caller
+            self._callers[filename] = caller
+            return caller
+
+    def accessor(self, name=None, pin=False):
+        """Return an accessor of the configuration of a module.
+
+        The accessor reads the local values of the module, then the global
+        ones, like the reader itself, without looking up who the caller is.
+
+        :param name: name of the module (without suffix), if empty, the
+            calling module is used
+        :param pin: if True, the accessor keeps reading the configuration
+            loaded at this moment, even if the reader reloads it (see
+            :meth:`watch`); this is useful to have a consistent configuration
+            during a whole run of a workflow
+        """
+        if name is None:
+            name = self._getCallerId(inspect.currentframe().f_back)
+        return ConfigAccessor(self, name, pin and self._snapshot or None)
 
     def getBaseDir(self):
         """Get basedir path."""
@@ -194,6 +355,10 @@ class ConfigReader(object):
         This is a root of the configuration directives from which other paths
         are resolved.
         """
+        self._setBasedir(basedir)
+        self.update()
+
+    def _setBasedir(self, basedir):
         if not (isinstance(basedir, list) or isinstance(basedir, tuple)):
             basedir = [basedir]
         new_base = []
@@ -205,7 +370,6 @@ class ConfigReader(object):
             if b not in new_base:
                 new_base.append(b)
         self._basedir = new_base
-        self.update()
 
     def update(self, files=None, replace_keys={}):
         """Update values reading them from the main configuration file(s).
@@ -221,22 +385,101 @@ class ConfigReader(object):
         if files is None:
             files = self._makeAllConfigPaths('global')
 
+        with self._lock:
+            old = self._snapshot
+            # the local configurations are interpolated with the global
+            # values, so they are loaded again
+            snapshot = _ConfigSnapshot(old.main_config,
+                                       dict(old.global_values),
+                                       old.sources)
+            snapshot.stamps = dict((file, old.stamps.get(file))
+                                   for file in old.sources)
+            updated = self._update_global(snapshot, files, replace_keys)
+            self._snapshot = snapshot
+        return updated
+
+    def _update_global(self, snapshot, files, replace_keys):
+        """Read the main configuration `files` into `snapshot`."""
         updated = 0
         for file in files:
+            # the files are read again in the same order when reloading
+            snapshot.sources.pop(file, None)
+            snapshot.sources[file] = dict(replace_keys)
+            snapshot.stamps[file] = _stamp(file)
             if os.path.exists(file):
                 # if we have more files, we will wrap/inherit them into one
                 # object this object should not be probably usef for writing
-                config = self._main_config = CustomConfigObj(
-                    file, encoding='UTF8', parent_config=self._main_config
+                config = snapshot.main_config = CustomConfigObj(
+                    file, encoding='UTF8', parent_config=snapshot.main_config
                 )
                 if replace_keys:
                     for k, v in replace_keys.items():
                         if k in config:
                             config[k] = v
-                self._update(self._global, config)
+                self._update(snapshot.global_values, config)
                 updated += 1
         return updated
 
+    def _cache_path(self, files):
+        """Return the path of the compiled cache of `files`, if any."""
+        existing = [file for file in files if os.path.exists(file)]
+        if existing:
+            return os.path.join(os.path.dirname(existing[-1]),
+                                self.CACHE_FILENAME)
+
+    def _load_cache(self, files):
+        """Load the main configuration `files` from their compiled cache.
+
+        :return: True if the cache was up to date and loaded
+        """
+        path = self._cache_path(files)
+        if not path:
+            return False
+        try:
+            with open(path, 'rb') as cache:
+                data = pickle.loads(cache.read())
+            if (data['version'] != self.CACHE_VERSION or
+                    data['files'] != list(files) or
+                    any(_stamp(file) != stamp
+                        for file, stamp in data['stamps'].items())):
+                return False
+        except Exception:
+            return False
+        snapshot = _ConfigSnapshot(data['main_config'],
+                                   data['global_values'],
+                                   ((file, {}) for file in files))
+        snapshot.stamps = data['stamps']
+        with self._lock:
+            self._snapshot = snapshot
+        return True
+
+    def _save_cache(self, files):
+        """Save the main configuration read from `files` to their cache."""
+        path = self._cache_path(files)
+        if not path:
+            return
+        snapshot = self._snapshot
+        data = {
+            'version': self.CACHE_VERSION,
+            'files': list(files),
+            'stamps': dict((file, snapshot.stamps.get(file))
+                           for file in files),
+            'main_config': snapshot.main_config,
+            'global_values': snapshot.global_values,
+        }
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as cache:
+                cache.write(pickle.dumps(data, 2))
+            os.rename(tmp_path, path)
+        except Exception:
+            log.debug('Cannot write the configuration cache %s', path,
+                      exc_info=True)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
     def init(self, filename):
         """Initialize configuration file."""
         if not os.path.exists(filename):
@@ -252,18 +495,107 @@ class ConfigReader(object):
         :param file: file to load config from (if empty, default ini file
             will be sought)
         """
-        self._recent_caller = name
-        self._local = {}
-        if file is None:
-            file = self._findConfigPath(name)
+        with self._lock:
+            if file is None:
+                self._local_files.pop(name, None)
+            else:
+                self._local_files[name] = file
+            self._recent_caller = name
+            snapshot = self._snapshot
+            snapshot.locals[name], file = self._read_local(name, snapshot)
+        if file:
+            return True
+
+    def _get_local(self, name, snapshot=None):
+        """Return the local configuration of a module, loading it once."""
+        snapshot = snapshot or self._snapshot
+        try:
+            return snapshot.locals[name]
+        except KeyError:
+            pass
+        local, _ = self._read_local(name, snapshot)
+        return snapshot.locals.setdefault(name, local)
+
+    def _read_local(self, name, snapshot):
+        """Read the local configuration of a module.
+
+        :return: the configuration and the file it was read from, if any
+        """
+        if name in self._local_files:
+            files = [self._local_files[name]]
+        elif name:
+            files = self._makeAllConfigPaths(name)
+        else:
+            files = []
 
-        if file and os.path.exists(file):
-            config = CustomConfigObj(file,
+        local = {}
+        found = None
+        for file in reversed(files):
+            snapshot.stamps[file] = _stamp(file)
+            if found is None and file and os.path.exists(file):
+                found = file
+        if found:
+            config = CustomConfigObj(found,
                                      encoding='UTF8',
-                                     parent_config=self._main_config)
+                                     parent_config=snapshot.main_config)
+            self._update(local, config)
+        return local, found
 
-            self._update(self._local, config)
-            return True
+    def reload(self):
+        """Read all the configuration files again.
+
+        The new configuration replaces the previous one at once, readers
+        see either of them, never a mix of both.
+        """
+        with self._lock:
+            old = self._snapshot
+            snapshot = _ConfigSnapshot()
+            for file, replace_keys in list(old.sources.items()):
+                self._update_global(snapshot, [file], replace_keys)
+            for name in list(old.locals):
+                snapshot.locals[name], _ = self._read_local(name, snapshot)
+            self._snapshot = snapshot
+
+    def watch(self, interval=1.0):
+        """Reload the configuration when its files change.
+
+        A daemon thread checks the modification times and sizes of the
+        configuration files every `interval` seconds, and reloads them in
+        the background when they change. Reading values does not check the
+        files.
+
+        :param interval: seconds between two checks of the files
+        """
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Event()
+            thread = threading.Thread(target=self._watch,
+                                      args=(interval, self._watcher),
+                                      name='workflow-config')
+            thread.daemon = True
+            thread.start()
+
+    def unwatch(self):
+        """Stop reloading the configuration when its files change."""
+        with self._lock:
+            if self._watcher is not None:
+                self._watcher.set()
+                self._watcher = None
+
+    def _watch(self, interval, stop):
+        failed = None
+        while not stop.wait(interval):
+            stamps = list(self._snapshot.stamps.items())
+            changed = dict((file, _stamp(file)) for file, _ in stamps)
+            if changed == dict(stamps) or changed == failed:
+                continue
+            try:
+                self.reload()
+                failed = None
+            except Exception:
+                log.exception('Cannot reload the configuration')
+                failed = changed
 
     def load(self, cfgfile, force_reload=False, failonerror=True,
              replace_keys={}):
@@ -301,8 +633,12 @@ class ConfigReader(object):
                 sys.stderr.write('Cannot find: %s' % cfgfile)
                 return
 
-        if realpath in self._on_demand and not force_reload:
-            return ConfigWrapper(realpath, self._on_demand[realpath])
+        if not force_reload:
+            with self._lock:
+                values = self._on_demand.pop(realpath, None)
+                if values is not None:
+                    self._on_demand[realpath] = values
+                    return ConfigWrapper(realpath, values)
 
         try:
             config = CustomConfigObj(realpath,
@@ -316,12 +652,17 @@ class ConfigReader(object):
             if failonerror:
                 raise ConfigObjError(msg)
             else:
-                self.traceback.print_exc()
+                traceback.print_exc()
                 return
 
-        self._on_demand[realpath] = {}
-        self._update(self._on_demand[realpath], config)
-        return ConfigWrapper(realpath, self._on_demand[realpath])
+        values = {}
+        self._update(values, config)
+        with self._lock:
+            self._on_demand.pop(realpath, None)
+            self._on_demand[realpath] = values
+            while len(self._on_demand) > self.MAX_ON_DEMAND:
+                self._on_demand.popitem(last=False)
+        return ConfigWrapper(realpath, values)
 
     def get(self, key, failonerror=True):
         """Get value from the key identified by string, eg. `index.dir`."""
@@ -390,17 +731,10 @@ class ConfigReader(object):
         return f
 
     def _update(self, pointer, config):
+        # the sections are not copied, they are read through views
         for key, cfg_val in config.items():
             if isinstance(cfg_val, Section):
-                o = cfgval()
-                for k, v in cfg_val.items():
-                    if isinstance(v, Section):
-                        o2 = cfgval()
-                        o.__setattr__(k, o2)
-                        self._update(o2, v)
-                    else:
-                        o.__setattr__(k, v)
-                pointer[key] = o
+                pointer[key] = ConfigView(cfg_val)
             else:
                 pointer[key] = cfg_val
 
@@ -433,6 +767,96 @@ class cfgval(dict):
         return '%s\n%s' % ('#cfgwrapper', repr(self))
 
 
+class ConfigView(Mapping):
+
+    """Read-only view of a configuration section.
+
+    The values are read from the section parsed by configobj, as attributes
+    or items, without copying it.
+    """
+
+    def __init__(self, section):
+        """Set the `section` to read."""
+        self.__dict__['_section'] = section
+
+    def __getattr__(self, key):
+        """Return the value of `key`."""
+        if key.startswith('__'):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        """Refuse to change the configuration."""
+        raise AttributeError('The configuration is read-only')
+
+    def __getitem__(self, key):
+        """Return the value of `key`."""
+        value = self._section[key]
+        if isinstance(value, Section):
+            return ConfigView(value)
+        return value
+
+    def __iter__(self):
+        """Iterate over the keys of the section."""
+        return iter(self._section)
+
+    def __len__(self):
+        """Return the number of keys of the section."""
+        return len(self._section)
+
+    def __repr__(self):
+        """Return representation of :class:`ConfigView` instance."""
+        return repr(dict(self.items()))
+
+
+class ConfigAccessor(object):
+
+    """Access to the configuration of one module.
+
+    Returned by :meth:`ConfigReader.accessor`.
+    """
+
+    def __init__(self, reader, name, snapshot=None):
+        """Set the `reader` and the `name` of the module.
+
+        :param snapshot: configuration to read, if empty, the current
+            configuration of the reader is read
+        """
+        self.__dict__['_reader'] = reader
+        self.__dict__['_name'] = name
+        self.__dict__['_snapshot'] = snapshot
+
+    def __getattr__(self, key):
+        """Return the local value of `key`, or the global one."""
+        reader = self._reader
+        snapshot = self._snapshot or reader._snapshot
+        local = snapshot.locals.get(self._name)
+        if local is None:
+            local = reader._get_local(self._name, snapshot)
+        if key in local:
+            return local[key]
+        elif key in snapshot.global_values:
+            return snapshot.global_values[key]
+        raise AttributeError(
+            'Attribute "%s" not defined\nlocal_config: %s' % (
+                key, reader._findConfigPath(self._name)))
+
+    def __setattr__(self, key, value):
+        """Refuse to change the configuration."""
+        raise AttributeError('The configuration is read-only')
+
+    def get(self, key):
+        """Allow recursive dotted key access to configuration."""
+        parts = key.split('.')
+        pointer = self
+        for p in parts:
+            pointer = getattr(pointer, p)
+        return pointer
+
+
 class ConfigWrapper(object):
 
     """Configuration wrapper."""
@@ -9,14 +9,17 @@
 
 """Define workflow engines and exceptions."""
 
+import atexit
 import logging
 import sys
+import threading
 from collections import (
     Iterable,
     Callable,
 )
 
 from six import reraise, string_types
+from six.moves import queue
 
 from .deprecation import deprecated
 from .errors import (
@@ -42,50 +45,146 @@ LOGGING_LEVEL = logging.NOTSET
 LOG = None
 
 
+class SignalDispatcher(object):
+    """Deliver signals to their receivers on a background thread.
+
+    Signals are delivered one by one in the order they were sent, which
+    preserves their order for every sender. When `maxsize` signals are
+    pending, sending a new one blocks until there is room if `policy` is
+    ``'block'``, or drops it if `policy` is ``'drop'``; dropped signals are
+    counted in `dropped`. Pending signals are delivered on interpreter exit.
+
+    Exceptions raised by receivers are logged instead of being raised in the
+    engine.
+    """
+
+    def __init__(self, maxsize=10000, policy='block'):
+        """Instantiate a new SignalDispatcher object."""
+        if policy not in ('block', 'drop'):
+            raise ValueError("policy must be either 'block' or 'drop'")
+        self.queue = queue.Queue(maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def dispatch(self, signal, *args, **kwargs):
+        """Queue the sending of `signal`."""
+        self._start()
+        try:
+            self.queue.put((signal, args, kwargs), self.policy == 'block')
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Wait until all the pending signals have been delivered."""
+        self.queue.join()
+
+    def close(self):
+        """Deliver the pending signals and stop the dispatcher thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='workflow-signals'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                signal, args, kwargs = item
+                signal.send(*args, **kwargs)
+            except Exception:
+                logging.getLogger('workflow').exception(
+                    "Error in a receiver of signal '%s'.", signal.name)
+            finally:
+                self.queue.task_done()
+
+
 class _Signal(object):
-    """Helper for storing signal callers."""
+    """Helper for storing signal callers.
+
+    The signals module is resolved on first use only, and signals without
+    receivers are not sent at all. Signals are delivered synchronously,
+    unless a `SignalDispatcher` is set as `dispatcher`.
+    """
 
     def __init__(self):
         self.errored_global = False
         self.errored_engine = False
+        self.dispatcher = None
+        self._signals = None
 
     def signals(self, eng=None):
-        try:
-            import workflow.signals as signals
-            return signals
-        except ImportError:
-            import_error_msg = ("Could not import signals lib; "
-                                "ignoring all future signal calls.")
-            if eng and not self.errored_engine:
-                eng.log.warning(import_error_msg)
-                self.errored_engine = True
-            elif not eng and not self.errored_global:
-                logging.warning(import_error_msg)
-                self.errored_global = True
+        if self._signals is None:
+            try:
+                import workflow.signals as signals
+            except ImportError:
+                signals = False
+            self._signals = signals
+        if self._signals is not False:
+            return self._signals
+        import_error_msg = ("Could not import signals lib; "
+                            "ignoring all future signal calls.")
+        if eng and not self.errored_engine:
+            eng.log.warning(import_error_msg)
+            self.errored_engine = True
+        elif not eng and not self.errored_global:
+            logging.warning(import_error_msg)
+            self.errored_global = True
+
+    def send(self, name, eng, *args, **kwargs):
+        """Send the signal `name` if signals is installed and it is used."""
+        signals = self.signals(eng)
+        if signals:
+            signal = getattr(signals, name)
+            if not signal.receivers:
+                return
+            if self.dispatcher is None:
+                signal.send(*args, **kwargs)
+            else:
+                self.dispatcher.dispatch(signal, *args, **kwargs)
 
     def workflow_halted(self, eng, *args, **kwargs):
         """Call the `workflow_halted` signal if signals is installed."""
-        signals = self.signals(eng)
-        if signals:
-            signals.workflow_halted.send(*args, **kwargs)
+        self.send('workflow_halted', eng, *args, **kwargs)
 
     def workflow_error(self, eng, *args, **kwargs):
         """Call the `workflow_error` signal if signals is installed."""
-        signals = self.signals(eng)
-        if signals:
-            signals.workflow_error.send(*args, **kwargs)
+        self.send('workflow_error', eng, *args, **kwargs)
 
     def workflow_started(self, eng, *args, **kwargs):
         """Call the `workflow_started` signal if signals is installed."""
-        signals = self.signals(eng)
-        if signals:
-            signals.workflow_started.send(*args, **kwargs)
+        self.send('workflow_started', eng, *args, **kwargs)
 
     def workflow_finished(self, eng, *args, **kwargs):
         """Call the `workflow_finished` signal if signals is installed."""
-        signals = self.signals(eng)
-        if signals:
-            signals.workflow_finished.send(*args, **kwargs)
+        self.send('workflow_finished', eng, *args, **kwargs)
+
+    def object_started(self, eng, **kwargs):
+        """Call the `object_started` signal, sent by `eng`, if it is used."""
+        self.send('object_started', eng, eng, **kwargs)
+
+    def object_finished(self, eng, **kwargs):
+        """Call the `object_finished` signal, sent by `eng`, if it is used."""
+        self.send('object_finished', eng, eng, **kwargs)
+
+    def task_failed(self, eng, **kwargs):
+        """Call the `task_failed` signal, sent by `eng`, if it is used."""
+        self.send('task_failed', eng, eng, **kwargs)
 
 
 Signal = _Signal()
@@ -966,6 +1065,7 @@ class TransitionActions(object):
     @staticmethod
     def Exception(obj, eng, callbacks, exc_info):
         """Action to take when an unhandled exception is raised."""
+        eng.signal.task_failed(eng, obj=obj, exc_info=exc_info)
         eng.signal.workflow_halted(eng)
         reraise(*exc_info)
 
@@ -1022,12 +1122,12 @@ class ProcessingFactory(object):
     @staticmethod
     def before_object(eng, objects, obj):
         """Action to take before processing an object."""
-        pass
+        eng.signal.object_started(eng, obj=obj)
 
     @staticmethod
     def after_object(eng, objects, obj):
         """Action to take after processing an object."""
-        pass
+        eng.signal.object_finished(eng, obj=obj)
 
 # ------------------------------------------------------------- #
 #                       helper methods/classes                  #
@@ -11,11 +11,20 @@
 
 from __future__ import absolute_import
 
+import atexit
+import hashlib
+import sys
+import threading
+import time
 import traceback
 
+from collections import OrderedDict
+from copy import deepcopy
 from enum import Enum
+from functools import partial
 
 from six import reraise
+from six.moves import queue
 
 from .engine import (
     GenericWorkflowEngine,
@@ -26,6 +35,10 @@ from .errors import WorkflowError
 from .utils import classproperty
 
 
+#: Value given to ``save_changes`` for the keys removed from a dictionary.
+DELETED = object()
+
+
 class EnumLabel(Enum):
     def __init__(self, label):
         self.label = self.labels[label]
@@ -75,6 +88,543 @@ class ObjectStatus(EnumLabel):
         }
 
 
+class TransactionPolicy(object):
+    """Define how the saves triggered by a `DbWorkflowEngine` are grouped.
+
+    :param batch_size: number of objects whose saves are committed together,
+        or ``None`` to commit the whole run at once.
+    """
+
+    def __init__(self, batch_size=1):
+        """Instantiate a new TransactionPolicy object."""
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be a positive integer or None")
+        self.batch_size = batch_size
+
+    @classmethod
+    def per_object(cls):
+        """Commit once every object has been processed."""
+        return cls(1)
+
+    @classmethod
+    def per_objects(cls, count):
+        """Commit once every `count` objects have been processed."""
+        return cls(count)
+
+    @classmethod
+    def per_run(cls):
+        """Commit once the engine stops processing."""
+        return cls(None)
+
+    def __repr__(self):
+        """Allow to represent the TransactionPolicy."""
+        return "<TransactionPolicy(batch_size=%s)>" % (self.batch_size,)
+
+
+class Transaction(object):
+    """Unit of work currently open on a `DbWorkflowEngine`.
+
+    Calls the `begin`, `commit` and `rollback` hooks of the engine as
+    dictated by its `transaction_policy`. Without a policy every method is
+    a no-op and each save stays an independent unit of work.
+    """
+
+    def __init__(self, eng):
+        """Instantiate a new Transaction object."""
+        self.eng = eng
+        self.active = False
+        self.count = 0
+        self.objects = []
+        self.completed = []
+
+    @property
+    def policy(self):
+        """Return the policy of the engine."""
+        return self.eng.transaction_policy
+
+    def begin(self):
+        """Open a new unit of work unless one is already open."""
+        if self.policy is None or self.active:
+            return
+        self.eng.persist(self.eng.begin)
+        self.active = True
+
+    def enter_object(self, obj):
+        """Account for `obj` in the current unit of work."""
+        self.begin()
+        self.count += 1
+        self.objects.append(obj)
+
+    def complete_object(self, obj):
+        """Mark `obj` as completed and commit if the batch is full."""
+        if not self.active:
+            return
+        self.completed.append(obj)
+        batch_size = self.policy.batch_size
+        if batch_size is not None and self.count >= batch_size:
+            self.commit()
+
+    def commit(self):
+        """Commit the current unit of work."""
+        if self.active:
+            self.eng.persist(self.eng.commit)
+        self._reset()
+
+    def rollback(self):
+        """Roll back the current unit of work.
+
+        The objects providing ``forget``, such as `TrackedObject`, are told
+        that their saves were discarded.
+
+        :return: objects that had completed within the rolled back unit of
+            work and whose saves have therefore been discarded.
+        """
+        completed = self.completed
+        if self.active:
+            self.eng.persist(self.eng.rollback)
+            for obj in self.objects:
+                forget = getattr(obj, 'forget', None)
+                if forget is not None:
+                    forget()
+        self._reset()
+        return completed
+
+    def _reset(self):
+        self.active = False
+        self.count = 0
+        self.objects = []
+        self.completed = []
+
+
+class BackgroundWriter(object):
+    """Run the persistence calls of `DbWorkflowEngine` on a dedicated thread.
+
+    Calls are executed one by one in the order they were submitted, so the
+    saves of every object reach the database in order. Once `maxsize` calls
+    are pending, submitting a new one blocks until the writer catches up.
+
+    After a failed call the remaining pending calls are discarded and the
+    error is re-raised on the next `submit`, `flush` or `close`.
+
+    The calls run while the engine keeps processing, so they must not read
+    data that the engine may still change: `DbWorkflowEngine.persist_object`
+    hands over copies of what to save for objects providing ``prepare_save``
+    and ``save_changes`` (see `TrackedObject`), and otherwise waits for the
+    save preceding the tasks of an object before running them.
+    """
+
+    def __init__(self, maxsize=1000):
+        """Instantiate a new BackgroundWriter object.
+
+        :param maxsize: maximum number of pending calls.
+        :type maxsize: int
+        """
+        self.queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._exc_info = None
+
+    def submit(self, func, *args, **kwargs):
+        """Queue `func(*args, **kwargs)` for execution."""
+        self._raise_error()
+        self._start()
+        self.queue.put((func, args, kwargs))
+
+    def flush(self):
+        """Wait until all the pending calls have been executed."""
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Flush the pending calls and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+        self._raise_error()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='workflow-writer'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self._exc_info is None:
+                    func, args, kwargs = item
+                    func(*args, **kwargs)
+            except Exception:
+                self._exc_info = sys.exc_info()
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        exc_info, self._exc_info = self._exc_info, None
+        if exc_info is not None:
+            reraise(*exc_info)
+
+
+class TrackedObject(object):
+    """Wrap a persisted workflow object to only save what has changed.
+
+    The wrapper remembers the values last persisted for the fields given to
+    ``save`` (`status`, `callback_pos`, `id_workflow`...) and for the
+    `tracked_data` attributes of the object. Saving without any change is a
+    no-op. Otherwise, if the wrapped object provides ``save_changes``, it is
+    given only the changes (see `changes`), else its ``save`` is called as
+    usual. ``save_changes`` receives copies of the new values: for the
+    dictionaries, a dictionary of the changed keys, where removed keys have
+    the value `DELETED`.
+
+    Once its saves have been rolled back (see `forget`), the object is saved
+    in full again.
+
+    Everything else is delegated to the wrapped object, so tasks can use the
+    wrapper in place of the object.
+    """
+
+    tracked_data = ('data', 'extra_data')
+
+    def __init__(self, obj):
+        """Instantiate a new TrackedObject object.
+
+        :param obj: the persisted object to wrap.
+        """
+        self.__dict__['wrapped'] = obj
+        self.__dict__['_saved_fields'] = {}
+        self.__dict__['_saved_data'] = self._snapshot()
+
+    def save(self, status=None, **fields):
+        """Save the wrapped object if anything changed since the last save.
+
+        Fields given as ``None`` are left untouched, as in ``save``.
+        """
+        write = self.prepare_save(status, **fields)
+        if write is not None:
+            write()
+
+    def prepare_save(self, status=None, **fields):
+        """Record a save with `fields` and return the call persisting it.
+
+        The changes are computed and remembered as saved right away; only the
+        returned call touches the wrapped object's persistence, so that it
+        can be run later by another thread (see `DbWorkflowEngine.persist`).
+
+        :return: callable persisting the changes, or None if nothing changed.
+        """
+        fields['status'] = status
+        fields = dict((key, value) for key, value in fields.items()
+                      if value is not None)
+        if self._saved_fields is None:
+            self.__dict__['_saved_fields'] = deepcopy(fields)
+            self.__dict__['_saved_data'] = self._snapshot()
+            return partial(self.wrapped.save, **fields)
+        changes = self.changes(**fields)
+        if not changes:
+            return None
+        for key, value in fields.items():
+            self._saved_fields[key] = deepcopy(value)
+        self._update_snapshot(changes)
+        save_changes = getattr(self.wrapped, 'save_changes', None)
+        if save_changes is not None:
+            return partial(save_changes, self._saved_values(changes))
+        return partial(self.wrapped.save, **fields)
+
+    def changes(self, **fields):
+        """Return what a save with `fields` would change.
+
+        :return: dict holding the new value of every changed field, and for
+            every changed `tracked_data` attribute either the set of changed
+            keys (for dictionaries) or its new value.
+        """
+        if self._saved_fields is None:
+            changes = dict(fields)
+            for key in self.tracked_data:
+                current = getattr(self.wrapped, key, None)
+                changes[key] = (set(current) if isinstance(current, dict)
+                                else current)
+            return changes
+        changes = {}
+        for key, value in fields.items():
+            try:
+                saved = self._saved_fields[key]
+            except KeyError:
+                saved = getattr(self.wrapped, key, None)
+            if value != saved:
+                changes[key] = value
+        for key, saved in self._saved_data.items():
+            current = getattr(self.wrapped, key, None)
+            if isinstance(current, dict) and isinstance(saved, dict):
+                changed_keys = set(
+                    k for k in set(current) | set(saved)
+                    if k not in current or k not in saved or
+                    current[k] != saved[k]
+                )
+                if changed_keys:
+                    changes[key] = changed_keys
+            elif current != saved:
+                changes[key] = current
+        return changes
+
+    @property
+    def saves_copies(self):
+        """Whether the next save only hands copies of values to the object.
+
+        Otherwise, the save reads the wrapped object itself.
+        """
+        return (self._saved_fields is not None and
+                getattr(self.wrapped, 'save_changes', None) is not None)
+
+    def forget(self):
+        """Forget what was saved, as the saves have been rolled back.
+
+        The next save writes all the fields and data of the object.
+        """
+        self.__dict__['_saved_fields'] = None
+        self.__dict__['_saved_data'] = None
+
+    def _saved_values(self, changes):
+        # The snapshot holds copies of the values just saved; they are only
+        # ever replaced, never changed, so the writer can read them.
+        values = dict(changes)
+        for key in self.tracked_data:
+            if key not in changes:
+                continue
+            saved = self._saved_data[key]
+            if isinstance(changes[key], set):
+                values[key] = dict((item, saved.get(item, DELETED))
+                                   for item in changes[key])
+            else:
+                values[key] = saved
+        return values
+
+    def _snapshot(self):
+        return dict((key, deepcopy(getattr(self.wrapped, key, None)))
+                    for key in self.tracked_data)
+
+    def _update_snapshot(self, changes):
+        # Only copy what changed rather than the whole record.
+        for key in self.tracked_data:
+            if key not in changes:
+                continue
+            current = getattr(self.wrapped, key, None)
+            saved = self._saved_data[key]
+            if isinstance(current, dict) and isinstance(saved, dict):
+                for item in changes[key]:
+                    if item in current:
+                        saved[item] = deepcopy(current[item])
+                    else:
+                        saved.pop(item, None)
+            else:
+                self._saved_data[key] = deepcopy(current)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.wrapped, name, value)
+
+    def __delattr__(self, name):
+        delattr(self.wrapped, name)
+
+    def __getitem__(self, key):
+        return self.wrapped[key]
+
+    def __setitem__(self, key, value):
+        self.wrapped[key] = value
+
+    def __delitem__(self, key):
+        del self.wrapped[key]
+
+    def __contains__(self, key):
+        return key in self.wrapped
+
+    def __iter__(self):
+        return iter(self.wrapped)
+
+    def __len__(self):
+        return len(self.wrapped)
+
+    def __bool__(self):
+        return bool(self.wrapped)
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        """Allow to represent the TrackedObject."""
+        return "<TrackedObject(%r)>" % (self.wrapped,)
+
+
+class ErrorReporter(object):
+    """Log the errors of workflow objects without flooding the logs.
+
+    Errors are fingerprinted by exception type, failing task and the
+    innermost frames of their traceback. The full traceback of a fingerprint
+    is logged at most once per `window` seconds; further occurrences within
+    the window are only counted and reported in a summary once the window
+    is over, even if the errors stopped in the meantime. The remaining
+    counts are summarized when the interpreter exits (see `close`).
+
+    A single reporter is meant to be shared by all the engines of a process.
+    """
+
+    def __init__(self, window=60, frames=3):
+        """Instantiate a new ErrorReporter object.
+
+        :param window: number of seconds during which the same error is
+            logged only once.
+        :param frames: number of innermost traceback frames to take into
+            account for the fingerprint.
+        """
+        self.window = window
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._next_summary = None
+        self._timer = None
+        self._log = None
+        atexit.register(self.close)
+
+    def fingerprint(self, exc_info, task=None):
+        """Return a short identifier of the error `exc_info` in `task`."""
+        exc_type = exc_info[0]
+        frames = traceback.extract_tb(exc_info[2])[-self.frames:]
+        key = repr((
+            exc_type.__module__, exc_type.__name__, task,
+            [tuple(frame)[:3] for frame in frames],
+        ))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+    def report(self, log, exc_info, exception_repr, task=None):
+        """Log the error `exc_info` unless it was logged recently.
+
+        :param log: logger to report to.
+        :param exc_info: the error, as returned by ``sys.exc_info()``.
+        :param exception_repr: the formatted traceback of the error.
+        :param task: name of the task that failed.
+        """
+        fingerprint = self.fingerprint(exc_info, task)
+        title = '%s in task %s' % (exc_info[0].__name__, task)
+        now = time.time()
+        with self._lock:
+            self._log = log
+            window = self._windows.get(fingerprint)
+            repeated = (window is not None and
+                        now - window['start'] < self.window)
+            if repeated:
+                window['count'] += 1
+            else:
+                self._windows[fingerprint] = {
+                    'start': now, 'count': 0, 'title': title,
+                }
+                if self._next_summary is None:
+                    self._next_summary = now + self.window
+                self._schedule(log, now)
+        if repeated:
+            log.debug("Error [%s] %s occurred again.", fingerprint, title)
+        else:
+            if window is not None and window['count']:
+                self._log_summary(log, fingerprint, window)
+            log.error("Error [%s] %s:\n%s", fingerprint, title,
+                      exception_repr)
+        self.summarize(log)
+
+    def summarize(self, log, force=False):
+        """Report how often the errors of the past windows reoccurred.
+
+        Called on every report, once the processing of objects is over and
+        when a window ends; call it with `force` to also summarize the
+        windows that are not over yet, for instance before exiting.
+        """
+        now = time.time()
+        summaries = []
+        with self._lock:
+            if not force and (self._next_summary is None or
+                              now < self._next_summary):
+                self._schedule(log, now)
+                return
+            self._next_summary = None
+            for fingerprint, window in list(self._windows.items()):
+                end = window['start'] + self.window
+                if force or now >= end:
+                    del self._windows[fingerprint]
+                    if window['count']:
+                        summaries.append((fingerprint, window))
+                elif self._next_summary is None or end < self._next_summary:
+                    self._next_summary = end
+            self._schedule(log, now)
+        for fingerprint, window in summaries:
+            self._log_summary(log, fingerprint, window)
+
+    def close(self):
+        """Summarize all the errors reported so far and stop the timer."""
+        with self._lock:
+            timer, self._timer = self._timer, None
+            log = self._log
+        if timer is not None:
+            timer.cancel()
+        if log is not None:
+            self.summarize(log, force=True)
+
+    def _schedule(self, log, now):
+        # Summarize when the next window ends, whether or not errors keep
+        # being reported. Called with the lock held.
+        if self._timer is not None or self._next_summary is None:
+            return
+        self._timer = threading.Timer(max(0, self._next_summary - now),
+                                      self._summarize_later, (log,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _summarize_later(self, log):
+        with self._lock:
+            self._timer = None
+        self.summarize(log)
+
+    def _log_summary(self, log, fingerprint, window):
+        log.error("Error [%s] %s occurred %d more time(s) in %s seconds.",
+                  fingerprint, window['title'], window['count'], self.window)
+
+
+class ResumedGroup(object):
+    """Outcome of resuming objects that were halted at the same task.
+
+    :param callback_pos: the task position the objects were resumed from.
+    :param objects: the resumed objects, grouped by their status afterwards
+        in `completed`, `halted` and `errored`.
+    """
+
+    def __init__(self, callback_pos, objects):
+        """Instantiate a new ResumedGroup object."""
+        self.callback_pos = callback_pos
+        self.objects = objects
+        self.completed = []
+        self.halted = []
+        self.errored = []
+        for obj in objects:
+            if obj.status == obj.known_statuses.COMPLETED:
+                self.completed.append(obj)
+            elif obj.status == obj.known_statuses.HALTED:
+                self.halted.append(obj)
+            elif obj.status == obj.known_statuses.ERROR:
+                self.errored.append(obj)
+
+    def __repr__(self):
+        """Allow to represent the ResumedGroup."""
+        return ("<ResumedGroup(callback_pos=%s, completed=%d, halted=%d, "
+                "errored=%d)>" % (self.callback_pos, len(self.completed),
+                                  len(self.halted), len(self.errored)))
+
+
 class DbWorkflowEngine(GenericWorkflowEngine):
     """GenericWorkflowEngine with DB persistence.
 
@@ -86,7 +636,14 @@ class DbWorkflowEngine(GenericWorkflowEngine):
     task calls (This part will be revisited in the future).
     """
 
-    def __init__(self, db_obj, **kwargs):
+    transaction_policy = None
+    writer = None
+    error_reporter = None
+    resume_callback_pos = None
+    _transaction = None
+
+    def __init__(self, db_obj, transaction_policy=None, writer=None,
+                 error_reporter=None, **kwargs):
         """Instantiate a new BibWorkflowEngine object.
 
         :param db_obj: the workflow engine
@@ -102,8 +659,27 @@ class DbWorkflowEngine(GenericWorkflowEngine):
 
         :param db_obj: instance of a Workflow object.
         :type db_obj: Workflow
+
+        :param transaction_policy: how to group the saves of the engine and
+            its objects into transactions; by default every save is an
+            independent unit of work.
+        :type transaction_policy: TransactionPolicy
+
+        :param writer: if given, saves are handed over to this writer instead
+            of blocking the processing of the objects.
+        :type writer: BackgroundWriter
+
+        :param error_reporter: if given, used to log the errors of the objects
+            instead of logging every traceback.
+        :type error_reporter: ErrorReporter
         """
         self.db_obj = db_obj
+        if transaction_policy is not None:
+            self.transaction_policy = transaction_policy
+        if writer is not None:
+            self.writer = writer
+        if error_reporter is not None:
+            self.error_reporter = error_reporter
         super(DbWorkflowEngine, self).__init__()
 
     @classproperty
@@ -166,11 +742,143 @@ DbWorkflowEngine
 -------------------------------
 """ % (self.db_obj.__str__(),)
 
+    @property
+    def transaction(self):
+        """Return the unit of work grouping the saves of this engine."""
+        if self._transaction is None:
+            self._transaction = Transaction(self)
+        return self._transaction
+
+    def process(self, objects, stop_on_error=True, stop_on_halt=True,
+                initial_run=True, reset_state=True):
+        """Start processing `objects`.
+
+        No transaction is left open and all the pending saves have reached
+        the database by the time this returns or raises.
+        """
+        try:
+            super(DbWorkflowEngine, self).process(
+                objects, stop_on_error=stop_on_error,
+                stop_on_halt=stop_on_halt, initial_run=initial_run,
+                reset_state=reset_state
+            )
+        except BaseException:
+            exc_info = sys.exc_info()
+            try:
+                self.transaction.rollback()
+                self.flush()
+            except Exception:
+                self.log.exception("Could not persist the state of the "
+                                   "workflow after a failure.")
+            self._summarize_errors()
+            reraise(*exc_info)
+        self.flush()
+        self._summarize_errors()
+
+    def _summarize_errors(self):
+        if self.error_reporter is not None:
+            self.error_reporter.summarize(self.log)
+
+    def resume_halted(self, objects=None, task='next'):
+        """Resume halted objects in bulk.
+
+        The objects are grouped by the task position they were halted at and
+        every group is resumed with a single pass of the engine starting at
+        that position. Halts and errors of single objects do not interrupt
+        the pass.
+
+        :param objects: halted objects to resume, by default all the
+            `halted_objects` of the workflow.
+        :param task: "next" to continue after the task that halted, or
+            "current" to run that task again.
+        :return: a `ResumedGroup` per task position, in order of first
+            appearance.
+        """
+        if task not in ('current', 'next'):
+            raise ValueError('Unknown start point for task: %s' % task)
+        if objects is None:
+            objects = self.halted_objects
+
+        groups = OrderedDict()
+        for obj in objects:
+            if obj.callback_pos is None:
+                self.log.warning("Cannot resume %r: no task position was "
+                                 "saved." % (obj,))
+                continue
+            groups.setdefault(tuple(obj.callback_pos), []).append(obj)
+
+        results = []
+        for callback_pos, group in groups.items():
+            callback_pos = list(callback_pos)
+            if task == 'next':
+                callback_pos[-1] += 1
+            self.log.debug("Resuming {0} objects from task {1}".format(
+                len(group), callback_pos))
+            self.resume_callback_pos = callback_pos
+            try:
+                self.process(group, stop_on_error=False, stop_on_halt=False)
+            finally:
+                del self.resume_callback_pos
+            results.append(ResumedGroup(callback_pos, group))
+        return results
+
+    def persist(self, func, *args, **kwargs):
+        """Call the persistence function `func`, through `writer` if set."""
+        if self.writer is None:
+            func(*args, **kwargs)
+        else:
+            self.writer.submit(func, *args, **kwargs)
+
+    def persist_object(self, obj, **fields):
+        """Save `obj` with `fields`, through `writer` if set.
+
+        Objects providing ``prepare_save`` work out what to save in the
+        calling thread; when their `saves_copies` is true, as for
+        `TrackedObject` wrapping objects with ``save_changes``, the writer
+        never reads data that the engine is still changing.
+
+        :return: True if the write submitted to `writer` reads `obj` itself,
+            which must then not be changed until it has been flushed.
+        """
+        prepare_save = getattr(obj, 'prepare_save', None)
+        if prepare_save is None:
+            self.persist(obj.save, **fields)
+        else:
+            copies = getattr(obj, 'saves_copies', False)
+            write = prepare_save(**fields)
+            if write is None:
+                return False
+            self.persist(write)
+            if copies:
+                return False
+        return self.writer is not None
+
+    def flush(self):
+        """Wait until all the pending saves have been executed."""
+        if self.writer is not None:
+            self.writer.flush()
+
     def save(self, status=None):
         """Save the workflow instance to database."""
         # This workflow continues a previous execution.
         self.db_obj.save(status)
 
+    def begin(self):
+        """Begin a transaction in the persistence layer.
+
+        Only called when a `transaction_policy` is set, in which case the
+        persistence object must implement `begin`, `commit` and `rollback`.
+        """
+        self.db_obj.begin()
+
+    def commit(self):
+        """Commit the transaction opened by `begin`."""
+        self.db_obj.commit()
+
+    def rollback(self):
+        """Roll back the transaction opened by `begin`."""
+        self.db_obj.rollback()
+
 
 class DbTransitionAction(TransitionActions):
     """Transition actions on engine exceptions for persistence object.
@@ -183,10 +891,11 @@ class DbTransitionAction(TransitionActions):
     def HaltProcessing(obj, eng, callbacks, exc_info):
         """Action to take when HaltProcessing is raised."""
         e = exc_info[1]
-        obj.save(status=obj.known_statuses.HALTED,
-                 task_counter=eng.state.callback_pos,
-                 id_workflow=eng.uuid)
-        eng.save(status=WorkflowStatus.HALTED)
+        eng.persist_object(obj, status=obj.known_statuses.HALTED,
+                           task_counter=list(eng.state.callback_pos),
+                           id_workflow=eng.uuid)
+        eng.persist(eng.save, status=WorkflowStatus.HALTED)
+        eng.transaction.commit()
         message = "Workflow '%s' halted at task %s with message: %s" % \
                   (eng.name, eng.current_taskname or "Unknown", e.message)
         eng.log.warning(message)
@@ -198,15 +907,27 @@ class DbTransitionAction(TransitionActions):
     def Exception(obj, eng, callbacks, exc_info):
         """Action to take when an otherwise unhandled exception is raised."""
         exception_repr = ''.join(traceback.format_exception(*exc_info))
-        msg = "Error:\n%s" % (exception_repr)
-        eng.log.error(msg)
+        if eng.error_reporter is None:
+            msg = "Error:\n%s" % (exception_repr)
+            eng.log.error(msg)
+        else:
+            eng.error_reporter.report(eng.log, exc_info, exception_repr,
+                                      task=eng.current_taskname)
+        # Discard the failed batch, but keep the objects that did complete.
+        completed = eng.transaction.rollback()
+        eng.transaction.begin()
+        for completed_obj in completed:
+            eng.persist_object(completed_obj,
+                               status=completed_obj.known_statuses.COMPLETED,
+                               id_workflow=eng.uuid)
         if obj:
             # Sets an error message as a tuple (title, details)
             obj.set_error_message(exception_repr)
-            obj.save(status=obj.known_statuses.ERROR,
-                     callback_pos=eng.state.callback_pos,
-                     id_workflow=eng.uuid)
-        eng.save(WorkflowStatus.ERROR)
+            eng.persist_object(obj, status=obj.known_statuses.ERROR,
+                               callback_pos=list(eng.state.callback_pos),
+                               id_workflow=eng.uuid)
+        eng.persist(eng.save, WorkflowStatus.ERROR)
+        eng.transaction.commit()
         try:
             super(DbTransitionAction, DbTransitionAction).Exception(
                 obj, eng, callbacks, exc_info
@@ -215,9 +936,9 @@ class DbTransitionAction(TransitionActions):
             # We expect this to reraise
             pass
         # Change the type of the Exception to WorkflowError, but use its tb
-        reraise(WorkflowError(
+        reraise(WorkflowError, WorkflowError(
             message=exception_repr, id_workflow=eng.uuid,
-            id_object=eng.state.token_pos), None, exc_info[2]
+            id_object=eng.state.token_pos), exc_info[2]
         )
 
 
@@ -232,8 +953,13 @@ class DbProcessingFactory(ProcessingFactory):
     @staticmethod
     def before_object(eng, objects, obj):
         """Action to take before the proccessing of an object begins."""
-        obj.save(status=obj.known_statuses.RUNNING,
-                 id_workflow=eng.db_obj.uuid)
+        if eng.resume_callback_pos is not None:
+            eng.state.callback_pos = list(eng.resume_callback_pos)
+        eng.transaction.enter_object(obj)
+        if eng.persist_object(obj, status=obj.known_statuses.RUNNING,
+                              id_workflow=eng.db_obj.uuid):
+            # The tasks would change the object while it is being saved.
+            eng.flush()
         super(DbProcessingFactory, DbProcessingFactory).before_object(
             eng, objects, obj
         )
@@ -242,8 +968,9 @@ class DbProcessingFactory(ProcessingFactory):
     def after_object(eng, objects, obj):
         """Action to take once the proccessing of an object completes."""
         # We save each object once it is fully run through
-        obj.save(status=obj.known_statuses.COMPLETED,
-                 id_workflow=eng.db_obj.uuid)
+        eng.persist_object(obj, status=obj.known_statuses.COMPLETED,
+                           id_workflow=eng.db_obj.uuid)
+        eng.transaction.complete_object(obj)
         super(DbProcessingFactory, DbProcessingFactory).after_object(
             eng, objects, obj
         )
@@ -251,7 +978,8 @@ class DbProcessingFactory(ProcessingFactory):
     @staticmethod
     def before_processing(eng, objects):
         """Executed before processing the workflow."""
-        eng.save(WorkflowStatus.RUNNING)
+        eng.transaction.begin()
+        eng.persist(eng.save, WorkflowStatus.RUNNING)
         super(DbProcessingFactory, DbProcessingFactory).before_processing(
             eng, objects
         )
@@ -259,7 +987,9 @@ class DbProcessingFactory(ProcessingFactory):
     @staticmethod
     def after_processing(eng, objects):
         """Action after process to update status."""
+        eng.transaction.begin()
         if eng.has_completed:
-            eng.save(WorkflowStatus.COMPLETED)
+            eng.persist(eng.save, WorkflowStatus.COMPLETED)
         else:
-            eng.save(WorkflowStatus.HALTED)
+            eng.persist(eng.save, WorkflowStatus.HALTED)
+        eng.transaction.commit()
@@ -155,6 +155,18 @@ class WorkflowObjectStatusError(Exception):
         self.id_object = id_object
 
 
+@with_str(('message', ('breaker', 'retry_at')))
+class CircuitOpenError(Exception):
+    """Raised by a task whose circuit breaker is open."""
+
+    def __init__(self, message, breaker=None, retry_at=None):
+        """Instanciate a CircuitOpenError object."""
+        self.message = message
+        self.breaker = breaker
+        self.retry_at = retry_at
+        super(CircuitOpenError, self).__init__(message)
+
+
 class WorkflowAPIError(Exception):
     """Raised when there is a problem with parameters at the API level."""
 
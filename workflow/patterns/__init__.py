@@ -15,12 +15,15 @@ from .controlflow import (STOP, BREAK, OBJ_JUMP_BWD, OBJ_JUMP_FWD, OBJ_NEXT,
 
 
 # conditions
-from .controlflow import IF, IF_NOT, IF_ELSE, WHILE
+from .controlflow import IF, IF_NOT, IF_ELSE, WHILE, FOR, FOR_EACH
 
 # basic patterns
-from .controlflow import PARALLEL_SPLIT, SYNCHRONIZE, SIMPLE_MERGE, CHOICE
+from .controlflow import (PARALLEL_SPLIT, PARALLEL_MAP, PREFETCH, SYNCHRONIZE,
+                          SIMPLE_MERGE, CHOICE)
 
 
 # helper functions
-from .utils import (EMPTY_CALL, ENG_GET, ENG_SET, OBJ_SET, OBJ_GET, ERROR, TRY,
-                    RUN_WF, CALLFUNC, DEBUG_CYCLE, PROFILE)
+from .utils import (EMPTY_CALL, ENG_GET, ENG_SET, ENG_EXTRACT, OBJ_SET,
+                    OBJ_GET, OBJ_EXTRACT, ERROR, TRY, RUN_WF, CALLFUNC,
+                    DEBUG_CYCLE, PROFILE, CIRCUIT_BREAKER, MEMOIZE,
+                    RATE_LIMIT)
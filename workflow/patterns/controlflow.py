@@ -12,12 +12,15 @@
 See http://www.yawlfoundation.org/pages/resources/patterns.html#basic
 """
 
-import threading
-import time
 import collections
+import itertools
+import multiprocessing
+import operator
+import threading
+import weakref
+from concurrent import futures
 from functools import wraps, partial
 
-from six.moves import _thread as thread, queue
 from six import string_types
 
 from .utils import with_nice_docs
@@ -26,6 +29,95 @@ from ..engine import Callbacks
 
 MAX_TIMEOUT = 30000
 
+MAX_WORKERS = 16
+
+MAX_PENDING = 1000
+
+MAX_PROCESSES = None
+
+_executor = None
+_pending = None
+_process_executor = None
+_executor_lock = threading.Lock()
+_pool = threading.local()
+
+
+def get_executor():
+    """Return the pool of threads shared by the parallel patterns.
+
+    The pool is created on first use with `MAX_WORKERS` threads, and accepts
+    up to `MAX_PENDING` calls that are queued or running.
+    """
+    global _executor, _pending
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
+            _pending = threading.BoundedSemaphore(MAX_PENDING)
+        return _executor
+
+
+def get_process_executor():
+    """Return the pool of processes shared by the data-parallel patterns.
+
+    The pool is created on first use with `MAX_PROCESSES` processes, by
+    default one per CPU.
+    """
+    global _process_executor
+    with _executor_lock:
+        if _process_executor is None:
+            _process_executor = futures.ProcessPoolExecutor(
+                max_workers=MAX_PROCESSES
+            )
+        return _process_executor
+
+
+def _in_worker(func, *args):
+    _pool.worker = True
+    try:
+        return func(*args)
+    finally:
+        _pool.worker = False
+
+
+def _submit(func, *args):
+    """Run `func` on the shared pool and return its future.
+
+    Blocks while `MAX_PENDING` calls are queued or running, so that a big
+    batch cannot pile up objects in the queue of the pool. Calls made from a
+    thread of the pool run immediately instead, so that nested branches
+    waiting for each other cannot exhaust the pool.
+    """
+    if getattr(_pool, 'worker', False):
+        future = futures.Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    executor = get_executor()
+    pending = _pending
+    pending.acquire()
+    try:
+        future = executor.submit(_in_worker, func, *args)
+    except BaseException:
+        pending.release()
+        raise
+    future.add_done_callback(lambda future: pending.release())
+    return future
+
+
+def _run_branch(branch, obj, engine_cls, lock):
+    new_eng = engine_cls()
+    new_eng.extra_data['lock'] = lock
+    new_eng.callbacks.replace([branch])
+    new_eng.process([obj])
+
+
+def _log_branch_error(eng, future):
+    error = future.exception()
+    if error is not None:
+        eng.log.error('Error in a parallel branch: %r', error)
+
 
 @with_nice_docs
 def TASK_JUMP_BWD(step=-1):
@@ -211,6 +303,22 @@ def WHILE(cond, branch):
     return [_x, branch, TASK_JUMP_BWD(-(len(branch) + 1))]
 
 
+_CMP_OPERATORS = {
+    "eq": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+
+    "==": operator.eq,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "in": operator.contains,
+}
+
+
 @with_nice_docs
 def CMP(a, b, op):
     """Task that can be used in if or something else to compare two values.
@@ -220,8 +328,11 @@ def CMP(a, b, op):
     :param op: Operator can be :
         eq , gt , gte , lt , lte
         == , >  , >=  , <  , <=
+        in (whether `b` is in `a`)
     :return: bool: result of the test
     """
+    compare = _CMP_OPERATORS[op]
+
     @wraps(CMP)
     def _CMP(obj, eng):
         a_ = a
@@ -230,20 +341,7 @@ def CMP(a, b, op):
             a_ = a_(obj, eng)
         while callable(b_):
             b_ = b_(obj, eng)
-        return {
-            "eq": lambda a_, b_: a_ == b_,
-            "gt": lambda a_, b_: a_ > b_,
-            "gte": lambda a_, b_: a_ >= b_,
-            "lt": lambda a_, b_: a_ < b_,
-            "lte": lambda a_, b_: a_ <= b_,
-
-            "==": lambda a_, b_: a_ == b_,
-            ">": lambda a_, b_: a_ > b_,
-            ">=": lambda a_, b_: a_ >= b_,
-            "<": lambda a_, b_: a_ < b_,
-            "<=": lambda a_, b_: a_ <= b_,
-            "in": lambda a_, b_: b_ in a_,
-        }[op](a_, b_)
+        return compare(a_, b_)
     _CMP.hide = True
     return _CMP
 
@@ -284,7 +382,7 @@ def FOR(get_list_function, setter, branch, cache_data=False, order="ASC"):
     branch = tuple(Callbacks.cleanup_callables(branch))
 
     def _for(obj, eng):
-        step = str(eng.getCurrTaskId())  # eg '[1]'
+        step = str(eng.state.callback_pos)  # eg '[1]'
         if "_Iterators" not in eng.extra_data:
             eng.extra_data["_Iterators"] = {}
 
@@ -293,7 +391,7 @@ def FOR(get_list_function, setter, branch, cache_data=False, order="ASC"):
                 return eng.extra_data["_Iterators"][step]["cache"]
             except KeyError:
                 if callable(get_list_function):
-                    return get_list()
+                    return get_list_function(obj, eng)
                 elif isinstance(get_list_function, collections.Iterable):
                     return list(get_list_function)
                 else:
@@ -334,8 +432,7 @@ def FOR(get_list_function, setter, branch, cache_data=False, order="ASC"):
             elif order == 'DSC':
                 eng.extra_data["_Iterators"][step]["value"] -= 1
         else:
-            setter(obj, eng, step,
-                   eng.extra_data["_Iterators"][step]["previous_data"])
+            # The setter already holds the last item of the list.
             del eng.extra_data["_Iterators"][step]
             eng.break_current_loop()
 
@@ -343,37 +440,226 @@ def FOR(get_list_function, setter, branch, cache_data=False, order="ASC"):
     return [_for, branch, TASK_JUMP_BWD(-(len(branch) + 1))]
 
 
+_END = object()
+
+
+def _loop_cursors(obj, eng):
+    """Return the cursors of the loops of `obj` and the key of the current one.
+
+    Cursors are stored in the `extra_data` of the object when it has one, so
+    that they follow the object when it is resumed. Otherwise they are stored
+    in the `extra_data` of the engine, per object position.
+    """
+    step = str(eng.state.callback_pos)
+    extra_data = getattr(obj, 'extra_data', None)
+    if isinstance(extra_data, dict):
+        return extra_data.setdefault('_Iterators', {}), step
+    return (eng.extra_data.setdefault('_Iterators', {}),
+            '%s:%s' % (eng.state.token_pos, step))
+
+
 @with_nice_docs
-def PARALLEL_SPLIT(*args):
-    """Start task in parallel.
+def FOR_EACH(iterable, setter, branch):
+    """For loop pulling the items lazily from an iterable.
+
+    Unlike `FOR`, the items are never gathered in a list: only the number of
+    items already consumed by the current object is stored in its
+    ``extra_data['_Iterators']`` (or in the engine's one if the object has no
+    `extra_data`), so that a halted loop resumes at the right item.
+
+    :param iterable: iterable, or function taking (obj, eng) and returning
+        one. Pass a function when iterating over an iterator, as it can only
+        be consumed once.
+    :param setter: key of `extra_data` to store the current item in, or
+        function taking (obj, eng, step, item).
+    :param branch: block of functions to run for every item.
+    @attention: when a loop is resumed by another engine, the items already
+        consumed are skipped by iterating over them again.
+    """
+    if isinstance(setter, string_types):
+        setter = partial(_setter, setter)
+    if callable(branch):
+        branch = (branch,)
+    branch = tuple(Callbacks.cleanup_callables(branch))
+    # Live iterators, kept outside of `extra_data` as they can't be saved.
+    iterators = weakref.WeakKeyDictionary()
+
+    def _for_each(obj, eng):
+        step = str(eng.state.callback_pos)
+        cursors, key = _loop_cursors(obj, eng)
+        cursor = cursors.setdefault(key, {'index': 0})
+        live = iterators.setdefault(eng, {})
+
+        owner, index, iterator = live.get(step, (None, None, None))
+        if owner is not obj or index != cursor['index']:
+            items = iterable(obj, eng) if callable(iterable) else iterable
+            iterator = itertools.islice(items, cursor['index'], None)
+
+        item = next(iterator, _END)
+        if item is _END:
+            del cursors[key]
+            live.pop(step, None)
+            eng.break_current_loop()
+
+        cursor['index'] += 1
+        live[step] = (obj, cursor['index'], iterator)
+        setter(obj, eng, step, item)
+
+    _for_each.__name__ = 'FOR_EACH'
+    return [_for_each, branch, TASK_JUMP_BWD(-(len(branch) + 1))]
+
+
+@with_nice_docs
+def PARALLEL_SPLIT(*args, **kwargs):
+    """Start tasks in parallel.
+
+    Every branch runs in a new engine, on the pool of threads shared by the
+    parallel patterns (see `get_executor`).
+
+    :param join: if True, wait for all the branches to finish before
+        continuing and raise the first error of a branch in the calling
+        engine. Otherwise the errors of the branches are only logged.
+    :param timeout: number of seconds to wait for the branches when joining.
+    :param engine: class of the engines running the branches, by default
+        the class of the calling engine.
 
     @attention: tasks A,B,C,D... are not addressable, you can't
         you can't use jumping to them (they are invisible to
         the workflow engine). Though you can jump inside the
         branches
-    @attention: tasks B,C,D... will be running on their own
-        once you have started them, and we are not waiting for
-        them to finish. Workflow will continue executing other
+    @attention: unless `join` is True, tasks B,C,D... will be running
+        on their own once you have started them, and we are not waiting
+        for them to finish. Workflow will continue executing other
         tasks while B,C,D... might be still running.
     @attention: a new engine is spawned for each branch or code,
         all operations works as expected, but mind that the branches
         know about themselves, they don't see other tasks outside.
         They are passed the object, but not the old workflow
         engine object
-    @postcondition: eng object will contain lock (to be used
-        by threads)
+    @attention: branches started from a branch run one after the other
+        in the thread of that branch.
+    @postcondition: the engines of the branches will contain a shared
+        lock in ``extra_data['lock']``
     """
-    def _parallel_split(obj, eng, calls):
-        lock = thread.allocate_lock()
-        eng.store['lock'] = lock
-        for func in calls:
-            new_eng = eng.duplicate()
-            new_eng.setWorkflow(
-                [lambda o, e: e.store.update({'lock': lock}), func]
+    join = kwargs.get('join', False)
+    timeout = kwargs.get('timeout')
+    engine = kwargs.get('engine')
+
+    def _parallel_split(obj, eng):
+        lock = threading.Lock()
+        engine_cls = engine or eng.__class__
+        pending = [_submit(_run_branch, branch, obj, engine_cls, lock)
+                   for branch in args]
+        if not join:
+            for future in pending:
+                future.add_done_callback(partial(_log_branch_error, eng))
+            return
+        not_done = futures.wait(pending, timeout).not_done
+        if not_done:
+            raise futures.TimeoutError(
+                '%d branches did not finish in time' % len(not_done)
             )
-            thread.start_new_thread(new_eng.process, ([obj], ))
-            # new_eng.process([obj])
-    return lambda o, e: _parallel_split(o, e, args)
+        for future in pending:
+            future.result()
+    _parallel_split.__name__ = 'PARALLEL_SPLIT'
+    return _parallel_split
+
+
+def _map_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def _item_setter(key, obj, eng, results):
+    obj[key] = results
+
+
+@with_nice_docs
+def PARALLEL_MAP(func, items, setter, chunksize=None, timeout=None):
+    """Apply a function to the items of the object on a pool of processes.
+
+    The items are sent in chunks to the pool of processes shared by the
+    data-parallel patterns (see `get_process_executor`), and the results
+    are gathered in the order of the items.
+
+    :param func: function taking an item and returning its result; it must
+        be picklable, i.e. defined at the top level of a module.
+    :param items: function taking (obj, eng) and returning the items.
+    :param setter: key of the object to store the list of results in, or
+        function taking (obj, eng, results).
+    :param chunksize: number of items sent to a process at once, by default
+        the items are split in four chunks per process.
+    :param timeout: number of seconds to wait for the results.
+    """
+    if isinstance(setter, string_types):
+        setter = partial(_item_setter, setter)
+
+    def _parallel_map(obj, eng):
+        values = list(items(obj, eng))
+        size = chunksize
+        if not size:
+            processes = MAX_PROCESSES or multiprocessing.cpu_count()
+            size = max(1, -(-len(values) // (processes * 4)))
+        pending = [
+            get_process_executor().submit(
+                _map_chunk, func, values[start:start + size]
+            )
+            for start in range(0, len(values), size)
+        ]
+        not_done = futures.wait(pending, timeout).not_done
+        if not_done:
+            raise futures.TimeoutError(
+                '%d chunks did not finish in time' % len(not_done)
+            )
+        results = []
+        for future in pending:
+            results.extend(future.result())
+        setter(obj, eng, results)
+    _parallel_map.__name__ = 'PARALLEL_MAP'
+    return _parallel_map
+
+
+@with_nice_docs
+def PREFETCH(loader, setter, ahead=5, maxsize=None):
+    """Load data for the upcoming objects while the current one is processed.
+
+    When an object reaches this task, the data of the next `ahead` objects
+    starts loading on the pool of threads shared by the parallel patterns
+    (see `get_executor`), and the data of the current object, loaded in
+    advance if possible, is stored into it. Loads in progress are kept per
+    engine, by object identity.
+
+    :param loader: function taking an object and returning its data, for
+        instance fetching remote metadata or database rows.
+    :param setter: key of the object to store the data in, or function
+        taking (obj, eng, data).
+    :param ahead: number of upcoming objects to load in advance.
+    :param maxsize: number of loads kept per engine, by default
+        ``2 * ahead + 1``; the oldest are discarded first.
+    """
+    if isinstance(setter, string_types):
+        setter = partial(_item_setter, setter)
+    maxsize = maxsize or 2 * ahead + 1
+    loads = weakref.WeakKeyDictionary()
+
+    def _prefetch(obj, eng):
+        cache = loads.setdefault(eng, collections.OrderedDict())
+        entry = cache.pop(id(obj), None)
+
+        position = eng.state.token_pos
+        for upcoming in eng.objects[position + 1:position + 1 + ahead]:
+            if id(upcoming) not in cache:
+                cache[id(upcoming)] = (upcoming, _submit(loader, upcoming))
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+        if entry is not None and entry[0] is obj:
+            data = entry[1].result()
+        else:
+            data = loader(obj)
+        setter(obj, eng, data)
+
+    _prefetch.__name__ = 'PREFETCH'
+    return _prefetch
 
 
 @with_nice_docs
@@ -386,36 +672,46 @@ def SYNCHRONIZE(*args, **kwargs):
         But if you pass a list of callables (branch of callables)
         which is potentionally a new workflow, we will first create a
         workflow engine with the workflows, and execute the branch in it
+    :param timeout: number of seconds to wait for the branches.
+    :param pass_results: if True, the last task is called with the list of
+        the futures of the branches, in order, as third argument, and the
+        errors of the branches are left to it. Otherwise the first error of
+        a branch is raised before running the last task.
     @attention: you should never jump out of the synchronized branches
+    @attention: branches run on the pool of threads shared by the
+        parallel patterns (see `get_executor`)
     """
-    timeout = MAX_TIMEOUT
-    if 'timeout' in kwargs:
-        timeout = kwargs['timeout']
+    timeout = kwargs.get('timeout', MAX_TIMEOUT)
+    pass_results = kwargs.get('pass_results', False)
 
     if len(args) < 2:
         raise Exception('You must pass at least two callables')
 
+    branches, final_task = args[:-1], args[-1]
+
     def _synchronize(obj, eng):
-        queue = MyTimeoutQueue()
-        # spawn a pool of threads, and pass them queue instance
-        for i in range(len(args) - 1):
-            t = MySpecialThread(queue)
-            t.setDaemon(True)
-            t.start()
-
-        for func in args[0:-1]:
-            if isinstance(func, list) or isinstance(func, tuple):
-                new_eng = eng.duplicate()
-                new_eng.setWorkflow(func)
-                queue.put(lambda: new_eng.process([obj]))
+        lock = threading.Lock()
+        pending = []
+        for func in branches:
+            if isinstance(func, (list, tuple)):
+                pending.append(
+                    _submit(_run_branch, func, obj, eng.__class__, lock)
+                )
             else:
-                queue.put(lambda: func(obj, eng))
+                pending.append(_submit(func, obj, eng))
 
-        # wait on the queue until everything has been processed
-        queue.join_with_timeout(timeout)
+        not_done = futures.wait(pending, timeout).not_done
+        if not_done:
+            raise futures.TimeoutError(
+                '%d branches did not finish in time' % len(not_done)
+            )
 
-        # run the last func
-        args[-1](obj, eng)
+        if pass_results:
+            final_task(obj, eng, pending)
+        else:
+            for future in pending:
+                future.result()
+            final_task(obj, eng)
     _synchronize.__name__ = 'SYNCHRONIZE'
     return _synchronize
 
@@ -480,30 +776,3 @@ def SIMPLE_MERGE(*args):
 
     workflow.append(final_task)
     return workflow
-
-
-class MyTimeoutQueue(queue.Queue):
-
-    def join_with_timeout(self, timeout):
-        self.all_tasks_done.acquire()
-        try:
-            endtime = time.time() + timeout
-            while self.unfinished_tasks:
-                remaining = endtime - time.time()
-                if remaining <= 0.0:
-                    raise threading.ThreadError('NotFinished')
-                time.sleep(.05)
-                self.all_tasks_done.wait(remaining)
-        finally:
-            self.all_tasks_done.release()
-
-
-class MySpecialThread(threading.Thread):
-
-    def __init__(self, itemq, *args, **kwargs):
-        threading.Thread.__init__(self, *args, **kwargs)
-        self.itemq = itemq
-
-    def run(self):
-        call = self.itemq.get()
-        call()
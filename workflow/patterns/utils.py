@@ -11,15 +11,24 @@ from __future__ import print_function
 
 import sys
 
+import atexit
 import collections
 import inspect
+import operator
 import pstats
+import re
 import six
+import sqlite3
+import threading
+import time
 import timeit
 import traceback
+from collections import OrderedDict
 from functools import wraps
 
-from workflow.errors import WorkflowTransition
+from six.moves import cPickle as pickle
+
+from workflow.errors import CircuitOpenError, WorkflowTransition
 
 
 try:
@@ -27,6 +36,24 @@ try:
 except ImportError:
     import profile as cProfile
 
+try:
+    import anydbm as dbm
+except ImportError:
+    import dbm
+
+
+def _describe(arg):
+    """Return a short description of `arg`, in constant time."""
+    if callable(arg):
+        return getattr(arg, '__name__', type(arg).__name__)
+    if isinstance(arg, six.string_types):
+        return repr(arg) if len(arg) <= 40 else repr(arg[:37]) + '...'
+    if isinstance(arg, (list, tuple, dict, set)):
+        return '%s<%d items>' % (type(arg).__name__, len(arg))
+    if arg is None or isinstance(arg, (bool, float) + six.integer_types):
+        return repr(arg)
+    return '<%s>' % type(arg).__name__
+
 
 def with_nice_docs(func):
     """Add nice documentation to the function returned by another function.
@@ -35,6 +62,10 @@ def with_nice_docs(func):
     automatically generated docs. This is specially useful for all the control
     flow functions defined here.
 
+    The generated docs only describe the arguments briefly (see
+    `_describe`), so that building workflows with big arguments (whole
+    branches, long lists...) stays fast.
+
     Args:
         func(callable): function to decorate, that must return a function.
         comment(string): override for the automatically generated docs.
@@ -46,7 +77,7 @@ def with_nice_docs(func):
     def _comment_from_params(*args, **kwargs):
         args_doc = (
             'args(' + ', '.join(
-                str(arg) for arg in args
+                _describe(arg) for arg in args
             ) + ')'
         )
         kwargs_doc = (
@@ -58,7 +89,9 @@ def with_nice_docs(func):
 
     @wraps(func)
     def _decorated_func(*args, **kwargs):
-        comment = kwargs.pop('comment', _comment_from_params(*args, **kwargs))
+        comment = kwargs.pop('comment', None)
+        if comment is None:
+            comment = _comment_from_params(*args, **kwargs)
         inner_func = func(*args, **kwargs)
         if callable(inner_func):
             inner_func.__doc__ = comment
@@ -160,61 +193,99 @@ def EMPTY_CALL(obj, eng):
 @with_nice_docs
 def ENG_GET(something):
     """this is the same as lambda obj, eng: eng.extra_data.get(something)
-    :param something: str, key of the object to retrieve
+    :param something: str, key of the object to retrieve, or a path into
+        nested values, such as 'metadata.authors[0].name'
     :return: value of the key from eng object
     """
-    @wraps(ENG_GET)
-    def x(obj, eng):
-        return eng.extra_data.setdefault(something, None)
+    if _parse_path(something) == (something,):
+        @wraps(ENG_GET)
+        def x(obj, eng):
+            return eng.extra_data.setdefault(something, None)
+    else:
+        get = _path_getter(something)
+
+        @wraps(ENG_GET)
+        def x(obj, eng):
+            try:
+                return get(eng.extra_data)
+            except _LOOKUP_ERRORS:
+                return None
     return x
 
 
 @with_nice_docs
 def ENG_SET(key, value):
     """this is the same as lambda obj, eng: eng.extra_data.update({'key': value})
-    :param key: str, key of the object to retrieve
+    :param key: str, key of the object to retrieve, or a path into nested
+        values, such as 'metadata.authors[0].name'
     :param value: anything
     @attention: this call is executed when the workflow is created
         therefore, the key and value must exist at the time
         (obj and eng don't exist yet)
     """
+    set_ = _path_setter(key)
+
     @wraps(ENG_SET)
     def _eng_set(obj, eng):
-        eng.extra_data[key] = value
+        set_(eng.extra_data, value)
     return _eng_set
 
 
+@with_nice_docs
+def ENG_EXTRACT(paths, default=None):
+    """Return a dictionary with the values of several paths of the engine
+    :param paths: list of keys of eng.extra_data, or paths into nested
+        values, such as 'metadata.authors[0].name'
+    :param default: value of the paths which do not exist
+    @see: OBJ_EXTRACT
+    """
+    extract = _path_extractor(paths, default)
+
+    @wraps(ENG_EXTRACT)
+    def x(obj, eng):
+        return extract(eng.extra_data)
+    return x
+
+
 @with_nice_docs
 def OBJ_GET(something, cond='all'):
     """this is the same as lambda obj, eng: something in obj and obj[something]
-    :param something: str, key of the object to retrieve or list of strings
+    :param something: str, key of the object to retrieve or list of strings;
+        keys can be paths into nested values, such as
+        'metadata.authors[0].name'
     :param cond: how to evaluate several keys, all|any|many
     :return: value of the key from obj object, if you are looking at several
         keys, then a list is returned. Watch for empty and None returns!
 
     """
-    @wraps(OBJ_GET)
-    def x(obj, eng):
-        if isinstance(something, six.string_types):
-            return something in obj and obj[something]
-        else:
-            if cond.lower() == 'any':
-                for o in something:
-                    if o in obj and obj[o]:
-                        return obj[o]
-            elif cond.lower() == 'many':
-                r = {}
-                for o in something:
-                    if o in obj and obj[o]:
-                        r[o] = obj[o]
-                return r
-            else:
-                r = {}
-                for o in something:
-                    if o in obj and obj[o]:
-                        r[o] = obj[o]
-                    else:
-                        return False
+    if isinstance(something, six.string_types):
+        get = _path_getter(something)
+
+        @wraps(OBJ_GET)
+        def x(obj, eng):
+            try:
+                return get(obj)
+            except _LOOKUP_ERRORS:
+                return False
+    else:
+        getters = [(o, _path_getter(o)) for o in something]
+        cond = cond.lower()
+
+        @wraps(OBJ_GET)
+        def x(obj, eng):
+            r = {}
+            for o, get in getters:
+                try:
+                    value = get(obj)
+                except _LOOKUP_ERRORS:
+                    value = None
+                if value:
+                    if cond == 'any':
+                        return value
+                    r[o] = value
+                elif cond not in ('any', 'many'):
+                    return False
+            if cond != 'any':
                 return r
 
     x.__name__ = 'OBJ_GET'
@@ -224,18 +295,42 @@ def OBJ_GET(something, cond='all'):
 @with_nice_docs
 def OBJ_SET(key, value):
     """this is the same as lambda obj, eng: obj.__setitem__(key, value)
-    :param key: str, key of the object to retrieve
+    :param key: str, key of the object to retrieve, or a path into nested
+        values, such as 'metadata.authors[0].name'
     :param value: anything
     @attention: this call is executed when the workflow is created
         therefore, the key and value must exist at the time
         (obj and eng don't exist yet)
     """
+    set_ = _path_setter(key)
+
     @wraps(OBJ_SET)
     def x(obj, eng):
-        obj[key] = value
+        set_(obj, value)
     x.__name__ = 'OBJ_SET'
     return x
 
+
+@with_nice_docs
+def OBJ_EXTRACT(paths, default=None):
+    """Return a dictionary with the values of several paths of the object
+    :param paths: list of keys of the object, or paths into nested values,
+        such as 'metadata.authors[0].name'
+    :param default: value of the paths which do not exist
+    :return: dictionary of path: value
+
+    The paths are walked in one pass, their common prefixes only once:
+    with ['metadata.title', 'metadata.authors[0].name'], obj['metadata']
+    is looked up a single time.
+    """
+    extract = _path_extractor(paths, default)
+
+    @wraps(OBJ_EXTRACT)
+    def x(obj, eng):
+        return extract(obj)
+    x.__name__ = 'OBJ_EXTRACT'
+    return x
+
 # ----------------------- error handlling -------------------------------
 
 
@@ -295,27 +390,625 @@ def TRY(onecall, retry=1, onfailure=Exception, verbose=True):
     return x
 
 
+class CircuitBreaker(object):
+    """Circuit breaker shared by the tasks calling the same backend.
+
+    The circuit is closed as long as calls succeed. After `threshold`
+    consecutive failures it opens, and calls are refused for `cooldown`
+    seconds. It is then half-open: one trial call is let through, which
+    closes the circuit if it succeeds or opens it again if it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, name, threshold=5, cooldown=60):
+        """Instantiate a new CircuitBreaker object.
+
+        :param name: name of the protected backend.
+        :param threshold: number of consecutive failures opening the circuit.
+        :param cooldown: number of seconds the circuit stays open.
+        """
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name, **kwargs):
+        """Return the breaker of `name`, shared by the whole process.
+
+        The breaker is created with `kwargs` on first use only.
+        """
+        with cls._breakers_lock:
+            if name not in cls._breakers:
+                cls._breakers[name] = cls(name, **kwargs)
+            return cls._breakers[name]
+
+    @property
+    def retry_at(self):
+        """Return when the circuit becomes half-open, if it is open."""
+        if self.state == self.OPEN:
+            return self.opened_at + self.cooldown
+
+    def allow(self):
+        """Return whether a call may be made now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.time() < self.opened_at + self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+            if self._trial:
+                # Another trial call is in progress.
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        """Record a successful call, closing the circuit."""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def release(self):
+        """End a call that was neither a success nor a failure.
+
+        A trial call ending this way leaves the circuit half-open, letting
+        the next call through as a new trial.
+        """
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        """Record a failed call, opening the circuit if needed."""
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if (self.state == self.HALF_OPEN or
+                    self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def __repr__(self):
+        """Allow to represent the CircuitBreaker."""
+        return "<CircuitBreaker(%r, state=%s)>" % (self.name, self.state)
+
+
+@with_nice_docs
+def CIRCUIT_BREAKER(call, breaker, threshold=5, cooldown=60, on_open='halt',
+                    failures=Exception):
+    """Protect a task calling a flaky backend with a circuit breaker.
+
+    While the circuit is open, objects fail fast instead of running the
+    call, depending on `on_open`:
+
+        - 'halt': halt with a payload holding the name of the breaker and
+          when it will let calls through again (``breaker``, ``retry_at``)
+        - 'skip': skip the object
+        - 'error': raise `CircuitOpenError`
+
+    :param call: the task to protect.
+    :param breaker: name of the breaker, shared by all the tasks and engines
+        of the process using that name, or a `CircuitBreaker`.
+    :param threshold: number of consecutive failures opening the circuit,
+        used when the breaker is created.
+    :param cooldown: number of seconds the circuit stays open, used when the
+        breaker is created.
+    :param on_open: what to do with objects while the circuit is open.
+    :param failures: exception, or tuple of exceptions, counted as failures
+        of the backend; other exceptions propagate without being counted.
+    """
+    if not callable(call):
+        raise Exception('You can wrap only one callable with CIRCUIT_BREAKER')
+    if on_open not in ('halt', 'skip', 'error'):
+        raise ValueError("on_open must be one of 'halt', 'skip' or 'error'")
+    if not isinstance(breaker, CircuitBreaker):
+        breaker = CircuitBreaker.get(breaker, threshold=threshold,
+                                     cooldown=cooldown)
+
+    @wraps(CIRCUIT_BREAKER)
+    def x(obj, eng):
+        if not breaker.allow():
+            msg = "Circuit breaker '%s' is open." % breaker.name
+            if on_open == 'halt':
+                eng.halt(msg, payload={'breaker': breaker.name,
+                                       'retry_at': breaker.retry_at})
+            elif on_open == 'skip':
+                eng.log.debug(msg)
+                eng.skip_token()
+            raise CircuitOpenError(msg, breaker=breaker.name,
+                                   retry_at=breaker.retry_at)
+        try:
+            result = call(obj, eng)
+        except WorkflowTransition:
+            # The backend answered, the task is only moving the workflow.
+            breaker.success()
+            raise
+        except failures:
+            breaker.failure()
+            raise
+        except BaseException:
+            # Not counted, but the call (maybe a trial) is over.
+            breaker.release()
+            raise
+        breaker.success()
+        return result
+
+    x.__name__ = 'CIRCUIT_BREAKER'
+    return x
+
+
+class SQLiteMemoBackend(object):
+    """Persistent backend of `MemoCache`, storing results in an SQLite file.
+
+    Keys and results must be picklable.
+    """
+
+    def __init__(self, path):
+        """Instantiate a new SQLiteMemoBackend object.
+
+        :param path: path of the SQLite file, created if needed.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS workflow_memo ('
+                ' key BLOB PRIMARY KEY, value BLOB, stored_at REAL)'
+            )
+
+    def lookup(self, key):
+        """Return ``(value, stored_at)`` for `key`, or None if missing."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, stored_at FROM workflow_memo WHERE key = ?',
+                (sqlite3.Binary(pickle.dumps(key, 2)),)
+            ).fetchone()
+        if row is not None:
+            return pickle.loads(bytes(row[0])), row[1]
+
+    def store(self, key, value, stored_at):
+        """Store `value` for `key`."""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO workflow_memo VALUES (?, ?, ?)',
+                (sqlite3.Binary(pickle.dumps(key, 2)),
+                 sqlite3.Binary(pickle.dumps(value, 2)), stored_at)
+            )
+
+    def close(self):
+        """Close the SQLite file."""
+        with self._lock:
+            self._db.close()
+
+
+class DbmMemoBackend(object):
+    """Persistent backend of `MemoCache`, storing results in a dbm file.
+
+    Keys and results must be picklable.
+    """
+
+    def __init__(self, path):
+        """Instantiate a new DbmMemoBackend object.
+
+        :param path: path of the dbm file, created if needed.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = dbm.open(path, 'c')
+
+    def lookup(self, key):
+        """Return ``(value, stored_at)`` for `key`, or None if missing."""
+        with self._lock:
+            try:
+                data = self._db[pickle.dumps(key, 2)]
+            except KeyError:
+                return None
+        return pickle.loads(data)
+
+    def store(self, key, value, stored_at):
+        """Store `value` for `key`."""
+        data = pickle.dumps((value, stored_at), 2)
+        with self._lock:
+            self._db[pickle.dumps(key, 2)] = data
+
+    def close(self):
+        """Close the dbm file."""
+        with self._lock:
+            self._db.close()
+
+
+class MemoCache(object):
+    """Cache of task results, with LRU eviction and optional expiry.
+
+    Up to `maxsize` results are kept in memory, the least recently used being
+    evicted first. Results older than `ttl` seconds are computed again. With
+    a persistent `backend`, results are also stored there, so that they
+    survive restarts; results missing from memory are looked up in it.
+    """
+
+    _caches = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, name, maxsize=1024, ttl=None, backend=None):
+        """Instantiate a new MemoCache object.
+
+        :param name: name of the cache.
+        :param maxsize: number of results kept in memory.
+        :param ttl: number of seconds results are valid, or None.
+        :param backend: optional `SQLiteMemoBackend` or `DbmMemoBackend`.
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name, **kwargs):
+        """Return the cache of `name`, shared by the whole process.
+
+        The cache is created with `kwargs` on first use only.
+        """
+        with cls._caches_lock:
+            if name not in cls._caches:
+                cls._caches[name] = cls(name, **kwargs)
+            return cls._caches[name]
+
+    def lookup(self, key):
+        """Return ``(found, result)`` for `key`."""
+        now = time.time()
+        with self._lock:
+            entry = self._results.pop(key, None)
+            if entry is not None and not self._expired(entry[1], now):
+                self._results[key] = entry
+                self.hits += 1
+                return True, entry[0]
+        entry = None
+        if self.backend is not None:
+            entry = self.backend.lookup(key)
+        if entry is not None and not self._expired(entry[1], now):
+            with self._lock:
+                self._remember(key, entry)
+                self.hits += 1
+            return True, entry[0]
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def store(self, key, result):
+        """Cache `result` for `key`."""
+        entry = (result, time.time())
+        with self._lock:
+            self._remember(key, entry)
+        if self.backend is not None:
+            self.backend.store(key, *entry)
+
+    def clear(self):
+        """Forget the results kept in memory and reset the counters."""
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = 0
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _remember(self, key, entry):
+        self._results.pop(key, None)
+        self._results[key] = entry
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def __repr__(self):
+        """Allow to represent the MemoCache."""
+        return "<MemoCache(%r, hits=%d, misses=%d)>" % (
+            self.name, self.hits, self.misses)
+
+
+@with_nice_docs
+def MEMOIZE(call, key, cache=None, maxsize=1024, ttl=None, backend=None):
+    """Cache the results of a pure task or condition.
+
+    :param call: the task or condition, whose result only depends on the
+        value returned by `key`.
+    :param key: function taking (obj, eng) and returning the hashable key of
+        the result; the result is not cached when it returns None.
+    :param cache: name of the cache, shared by all the tasks and engines of
+        the process using that name, or a `MemoCache`. By default, the task
+        gets a cache of its own.
+    :param maxsize: number of results kept in memory, used when the cache is
+        created.
+    :param ttl: number of seconds results are valid, used when the cache is
+        created.
+    :param backend: persistent backend, used when the cache is created.
+    @attention: only the result is cached, the side effects of `call` do not
+        happen again for cached results.
+    """
+    if not callable(call):
+        raise Exception('You can wrap only one callable with MEMOIZE')
+    if cache is None:
+        # Lambdas, partials and callable objects have no distinct name to
+        # share a cache by.
+        cache = MemoCache(getattr(call, '__name__', type(call).__name__),
+                          maxsize=maxsize, ttl=ttl, backend=backend)
+    elif not isinstance(cache, MemoCache):
+        cache = MemoCache.get(cache, maxsize=maxsize, ttl=ttl,
+                              backend=backend)
+
+    @wraps(MEMOIZE)
+    def x(obj, eng):
+        cache_key = key(obj, eng)
+        if cache_key is None:
+            return call(obj, eng)
+        found, result = cache.lookup(cache_key)
+        if not found:
+            result = call(obj, eng)
+            cache.store(cache_key, result)
+        return result
+
+    x.__name__ = 'MEMOIZE'
+    x.cache = cache
+    return x
+
+
+class TokenBucket(object):
+    """Token bucket allowing `rate` calls per second, in bursts of `burst`.
+
+    Callers reserve their tokens in advance: the bucket may go into debt, and
+    every caller only waits for its own turn, without polling.
+    """
+
+    def __init__(self, rate, burst=1):
+        """Instantiate a new TokenBucket object.
+
+        :param rate: number of tokens added per second.
+        :param burst: maximum number of tokens in the bucket.
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1, max_wait=None):
+        """Reserve `tokens` and return how long to wait before using them.
+
+        This never blocks, so that asynchronous code can wait with its own
+        primitives, e.g. ``await asyncio.sleep(bucket.reserve())``.
+
+        :param max_wait: if the wait would be longer than this number of
+            seconds, nothing is reserved and None is returned.
+        :return: number of seconds to wait, or None.
+        """
+        with self._lock:
+            now = time.time()
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            wait = max(0.0, (tokens - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.tokens -= tokens
+            return wait
+
+    def acquire(self, tokens=1, timeout=None):
+        """Wait until `tokens` can be used.
+
+        :param timeout: maximum number of seconds to wait.
+        :return: False if the tokens could not be acquired in time.
+        """
+        wait = self.reserve(tokens, timeout)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class RateLimiter(object):
+    """Token buckets of the same rate, shared by the whole process.
+
+    One bucket is created per key, for instance per remote host.
+    """
+
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, name, rate, burst=1):
+        """Instantiate a new RateLimiter object.
+
+        :param name: name of the limited resource.
+        :param rate: number of calls allowed per second and per key.
+        :param burst: number of calls allowed at once per key.
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name, **kwargs):
+        """Return the limiter of `name`, shared by the whole process.
+
+        The limiter is created with `kwargs` on first use only.
+        """
+        with cls._limiters_lock:
+            if name not in cls._limiters:
+                cls._limiters[name] = cls(name, **kwargs)
+            return cls._limiters[name]
+
+    def bucket(self, key=None):
+        """Return the bucket of `key`."""
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rate, self.burst)
+            return self._buckets[key]
+
+    def __repr__(self):
+        """Allow to represent the RateLimiter."""
+        return "<RateLimiter(%r, rate=%s, burst=%s)>" % (
+            self.name, self.rate, self.burst)
+
+
+@with_nice_docs
+def RATE_LIMIT(call, limiter, rate=1, burst=1, key=None, timeout=None):
+    """Run a task at a limited rate, shared by all the engines and threads.
+
+    :param call: the task to limit.
+    :param limiter: name of the limiter, shared by all the tasks and engines
+        of the process using that name, or a `RateLimiter`.
+    :param rate: number of calls per second, used when the limiter is
+        created.
+    :param burst: number of calls allowed at once, used when the limiter is
+        created.
+    :param key: optional function taking (obj, eng) and returning the key of
+        the bucket to use, for instance the remote host.
+    :param timeout: maximum number of seconds to wait for a token; when it
+        would take longer, the workflow halts with a payload holding the
+        name of the limiter and the key (``limiter``, ``key``).
+    """
+    if not callable(call):
+        raise Exception('You can wrap only one callable with RATE_LIMIT')
+    if not isinstance(limiter, RateLimiter):
+        limiter = RateLimiter.get(limiter, rate=rate, burst=burst)
+
+    @wraps(RATE_LIMIT)
+    def x(obj, eng):
+        bucket_key = key(obj, eng) if key else None
+        if not limiter.bucket(bucket_key).acquire(timeout=timeout):
+            eng.halt("Rate limit '%s' exceeded." % limiter.name,
+                     payload={'limiter': limiter.name, 'key': bucket_key})
+        return call(obj, eng)
+
+    x.__name__ = 'RATE_LIMIT'
+    return x
+
+
+class ProfileAggregator(object):
+    """Accumulate the profiles of many calls and write them once.
+
+    Writes the merged stats to `output`, readable with `pstats`, and a
+    collapsed-stack file to ``output + '.collapsed'``, which flame graph
+    tools read. As `cProfile` does not record whole stacks, every stack of
+    that file is the path of the profiled task followed by one function,
+    weighted by the time spent in that function itself (in microseconds).
+    """
+
+    _aggregators = {}
+    _aggregators_lock = threading.Lock()
+
+    def __init__(self, output):
+        """Instantiate a new ProfileAggregator object.
+
+        :param output: path of the merged stats file.
+        """
+        self.output = output
+        self.stats = None
+        self.stacks = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, output):
+        """Return the aggregator writing to `output`, shared by the process.
+
+        It is written when the interpreter exits.
+        """
+        with cls._aggregators_lock:
+            if output not in cls._aggregators:
+                cls._aggregators[output] = cls(output)
+                atexit.register(cls._aggregators[output].dump)
+            return cls._aggregators[output]
+
+    def profile(self, path, func, *args, **kwargs):
+        """Call `func` with the profiler and account it under `path`.
+
+        :param path: list of the names of the profiled task.
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            self.add(path, profiler)
+
+    def add(self, path, profiler):
+        """Add the stats of `profiler` under `path`."""
+        stats = pstats.Stats(profiler)
+        prefix = ';'.join(name.replace(';', ',') for name in path)
+        with self._lock:
+            if self.stats is None:
+                self.stats = stats
+            else:
+                self.stats.add(stats)
+            for (filename, line, name), value in stats.stats.items():
+                frame = '%s:%s(%s)' % (filename, line, name)
+                self.stacks[prefix + ';' + frame.replace(';', ',')] += \
+                    int(value[2] * 1e6)
+
+    def dump(self):
+        """Write the stats accumulated so far."""
+        with self._lock:
+            if self.stats is None:
+                return
+            self.stats.dump_stats(self.output)
+            with open(self.output + '.collapsed', 'w') as collapsed:
+                for stack, weight in sorted(self.stacks.items()):
+                    if weight:
+                        collapsed.write('%s %d\n' % (stack, weight))
+
+
 @with_nice_docs
 def PROFILE(call, output=None,
-            stats=['time', 'calls', 'cumulative', 'pcalls']):
+            stats=['time', 'calls', 'cumulative', 'pcalls'],
+            aggregate=False):
     """Run the call(s) inside profiler
     :param call: either function or list of functions
         - if it is a single callable, it will be executed
-        - if it is a list of callables, a new workflow engine (a duplicate)
-          will be created, the workflow will be set with the calls, and
-          calls executed; thus by providing list of functions, you are
+        - if it is a list of callables, a new workflow engine (of the same
+          class) will be created, the workflow will be set with the calls,
+          and calls executed; thus by providing list of functions, you are
           actually profiling also the workflow engine!
     :param output: where to save the stats, if empty, it will be printed
           to stdout
     :param stats: list of statistical outputs,
           default is: time, calls, cumulative, pcalls
           @see pstats module for explanation
+    :param aggregate: if True, the stats of all the objects and engines
+          using the same `output` are accumulated, and only written when
+          the interpreter exits, along with a collapsed-stack file (see
+          `ProfileAggregator`); `stats` is then ignored
     """
+    if aggregate and not output:
+        raise ValueError('Aggregated profiles need an output')
+    if isinstance(call, (list, tuple)):
+        name = 'workflow'
+    else:
+        name = getattr(call, '__name__', repr(call))
+
     @wraps(PROFILE)
     def x(obj, eng):
         if isinstance(call, list) or isinstance(call, tuple):
-            new_eng = eng.duplicate()
-            new_eng.setWorkflow(call)
+            new_eng = eng.__class__()
+            new_eng.callbacks.replace(call)
 
             def profileit():
                 return new_eng.process([obj])
@@ -323,6 +1016,14 @@ def PROFILE(call, output=None,
             def profileit():
                 return call(obj, eng)
 
+        if aggregate:
+            path = [getattr(eng, 'name', None) or eng.__class__.__name__,
+                    'task %s' % '/'.join(
+                        str(i) for i in eng.state.callback_pos),
+                    name]
+            ProfileAggregator.get(output).profile(path, profileit)
+            return
+
         if output:
             cProfile.runctx('profileit()', globals(), locals(), output)
         else:
@@ -502,56 +1203,168 @@ def CALLFUNC(func, outkey=None, debug=False, stopper=None,
         inside the *args; you can use syntactic sugar to instruct
         system where to take the value, for example Eseman - will
         take eng.extra_data['seman'] -- 'O' [capital letter Oooo] means
-        take the value from obj
+        take the value from obj; a KeyError is raised when the value
+        is not available
     :param **kwargs: other kwargs passed on to the function
     :return: nothing, value is stored inside obj[outkey]
     """
     mod, new_func = _get_mod_func(func)
-    args = list(args)
+    args = tuple(args)
+    resolvers = tuple(_oearg_resolver(key) for key in oeargs)
+    ekeys = tuple(ekeys.items())
+    okeys = tuple(okeys.items())
 
     @wraps(CALLFUNC)
     def x(obj, eng):
-        try:
-            for key in oeargs:
-                first_key, rest_key = key[0], key[1:]
-                if first_key == 'O':
-                    args.append(obj[rest_key])
-                elif first_key == 'E' and rest_key in eng.extra_data:
-                    args.append(eng.extra_data.setdefault(rest_key))
-                else:
-                    if key in obj:
-                        args.append(obj[key])
-                    elif key in eng.extra_data:
-                        args.append(eng.extra_data.setdefault(key))
-                    else:
-                        raise Exception(
-                            "%s is not inside obj nor eng, try specifying "
-                            "Okey or Ekey" % key)
-        except Exception as msg:
-            eng.log.error(traceback.format_exc())
-            eng.log.error(
-                'Check your "oeargs" configuration. '
-                'Key "%s" not available' % key)
-            sys.exit(1)
-
-        for k, v in ekeys.items():
-            kwargs[k] = eng.extra_data[v]
-        for k, v in okeys.items():
-            kwargs[k] = obj[v]
+        call_args = args + tuple(resolve(obj, eng) for resolve in resolvers)
+        call_kwargs = dict(kwargs)
+        for k, v in ekeys:
+            call_kwargs[k] = eng.extra_data[v]
+        for k, v in okeys:
+            call_kwargs[k] = obj[v]
 
         if debug:
-            universal_repeater(mod, new_func, stopper, *args, **kwargs)
+            universal_repeater(mod, new_func, stopper,
+                               *call_args, **call_kwargs)
         else:
             if outkey:
-                obj[outkey] = new_func(*args, **kwargs)
+                obj[outkey] = new_func(*call_args, **call_kwargs)
             else:
-                new_func(*args, **kwargs)
+                new_func(*call_args, **call_kwargs)
     x.__name__ = 'CALLFUNC'
     return x
 
 # ----------------- not wf tasks -----------------------------
 
 
+_PATH_TOKEN = re.compile(
+    r"""(?:^|\.)([^.\[\]]+)|\[(-?\d+)\]|\[(['"])(.*?)\3\]""")
+_LOOKUP_ERRORS = (KeyError, IndexError, TypeError)
+
+
+def _parse_path(path):
+    """Split a path such as 'metadata.authors[0].name' into a tuple of keys.
+
+    A name followed by a dot or an opening bracket is a key, a number in
+    brackets is an index, a quoted string in brackets is a key which may
+    contain dots or brackets. Anything but a non-empty string is a key.
+    """
+    if not isinstance(path, six.string_types) or not path:
+        return (path,)
+    keys = []
+    pos = 0
+    while pos < len(path):
+        match = _PATH_TOKEN.match(path, pos)
+        if not match:
+            raise ValueError('Invalid path %r at position %d' % (path, pos))
+        name, index, _, quoted = match.groups()
+        if name is not None:
+            keys.append(name)
+        elif index is not None:
+            keys.append(int(index))
+        else:
+            keys.append(quoted)
+        pos = match.end()
+    return tuple(keys)
+
+
+def _path_getter(path):
+    """Return a callable taking the value at `path` of its argument.
+
+    It raises one of `_LOOKUP_ERRORS` if the path does not exist.
+    """
+    keys = _parse_path(path)
+    if len(keys) == 1:
+        return operator.itemgetter(keys[0])
+
+    def get(value):
+        for key in keys:
+            value = value[key]
+        return value
+    return get
+
+
+def _path_setter(path):
+    """Return a callable setting the value at `path` of its first argument.
+
+    The containers on the way must exist.
+    """
+    keys = _parse_path(path)
+    parent, last = keys[:-1], keys[-1]
+
+    def set_(value, new_value):
+        for key in parent:
+            value = value[key]
+        value[last] = new_value
+    return set_
+
+
+def _path_extractor(paths, default=None):
+    """Return a callable taking the values at several `paths` at once.
+
+    The paths are merged into a tree, so that their common prefixes are
+    looked up only once; the callable returns a dictionary path: value.
+    """
+    tree = OrderedDict()
+    for path in paths:
+        keys = _parse_path(path)
+        node = tree
+        for key in keys[:-1]:
+            node = node.setdefault(key, (OrderedDict(), []))[0]
+        node.setdefault(keys[-1], (OrderedDict(), []))[1].append(path)
+
+    def freeze(node):
+        return tuple((key, freeze(children), tuple(ends))
+                     for key, (children, ends) in node.items())
+    tree = freeze(tree)
+
+    def walk(value, node, result):
+        for key, children, ends in node:
+            try:
+                child = value[key]
+            except _LOOKUP_ERRORS:
+                continue
+            for path in ends:
+                result[path] = child
+            if children:
+                walk(child, children, result)
+
+    def extract(value):
+        result = dict.fromkeys(paths, default)
+        walk(value, tree, result)
+        return result
+    return extract
+
+
+def _oearg_resolver(key):
+    """Return a callable taking the value of a CALLFUNC `oeargs` key.
+
+    The 'O' and 'E' prefixes are parsed here, once, not on every call.
+    """
+    first_key, rest_key = key[:1], key[1:]
+
+    def lookup(obj, eng):
+        if key in obj:
+            return obj[key]
+        elif key in eng.extra_data:
+            return eng.extra_data[key]
+        raise KeyError(
+            '%s is not inside obj nor eng, try specifying Okey or Ekey '
+            '(check your "oeargs" configuration)' % key)
+
+    if first_key == 'O':
+        def resolve(obj, eng):
+            return obj[rest_key]
+    elif first_key == 'E':
+        def resolve(obj, eng):
+            if rest_key in eng.extra_data:
+                return eng.extra_data[rest_key]
+            return lookup(obj, eng)
+    else:
+        resolve = lookup
+    return resolve
+
+
 def _get_mod_func(func):
     """for a given callable finds its module - imports it
     and returns module, call -- module can be reloaded"""
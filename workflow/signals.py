@@ -41,3 +41,22 @@ This signal is sent when a workflow object gets an error.
 Sender is the workflow engine object that was running before the workflow
 got the error.
 """
+
+object_started = _signals.signal('object_started')
+"""
+This signal is sent before a workflow engine starts processing an object.
+Sender is the workflow engine object, the object is passed as `obj`.
+"""
+
+object_finished = _signals.signal('object_finished')
+"""
+This signal is sent when a workflow engine has processed an object.
+Sender is the workflow engine object, the object is passed as `obj`.
+"""
+
+task_failed = _signals.signal('task_failed')
+"""
+This signal is sent when a task raises an unhandled exception.
+Sender is the workflow engine object, the object is passed as `obj` and
+the result of ``sys.exc_info()`` as `exc_info`.
+"""